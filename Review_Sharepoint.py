@@ -1,10 +1,11 @@
 import json
 import requests
 from msal import ConfidentialClientApplication
-import pydantic
 import pandas as pd
 import io
 from time import sleep
+from folder_rollup import FolderRollup
+from graph_models import DriveItem, DRIVE_FACETS, decode_page, to_frame
 
 ##updated 6/11/2024
 
@@ -126,7 +127,8 @@ drive_list = pd.concat(frames)
 dl = drive_list['id'].tolist()
 len(dl)
 
-# Using list of Drives get a list of child items in each drive and when they were created/last modified
+# Using list of Drives get every item in each drive (root/delta returns the whole tree flat, not just root children)
+# and when they were created/last modified
 # I found many drives with 0 items which is to be expected and found many drives with 1000's of items
 
 
@@ -134,7 +136,8 @@ frame=[]
 number = 0
 while number < max_url:
     try:
-        url = f"https://graph.microsoft.com/v1.0/drives/{dl[number]}/root/children"
+        url = (f"https://graph.microsoft.com/v1.0/drives/{dl[number]}/root/delta"
+               "?$select=id,name,size,file,folder,parentReference,lastModifiedDateTime,lastModifiedBy,deleted")
         
         http_headers = {'Authorization': 'Bearer ' + result['access_token'],
                         'Accept': 'application/json',
@@ -147,19 +150,16 @@ while number < max_url:
         while url:
             response = requests.get(url, headers=http_headers, stream=False)
             sleep(.1)
-            data = response.json()
-           
-            
-
-            # Normalize and append the data
-            df = pd.json_normalize(data['value'])
-            frame.append(df)
+            if response.status_code == 429:
+                sleep(int(response.headers.get('Retry-After', 10)))
+                continue
+            # Decode straight to typed DriveItems (only the selected fields), same dotted columns as json_normalize
+            # any other error body raises GraphError and is reported below for this drive
+            items, url, _ = decode_page(response.content, DriveItem)
+            frame.append(to_frame(items, DriveItem, facets=DRIVE_FACETS))
             sleep(.1)
 
             # Check for the next page
-       
-           
-            url = data.get('@odata.nextLink')
             if url:
                 print(f"Next page URL: {url}")
         
@@ -201,4 +201,14 @@ SillyGoose@*****.com        9
 
 # you can identify sites that have not been modified in over 10 years, which can be a good indicator that the files/sites are good candidates for archiving
 
+# Roll every folder up from the full listing: recursive size, file count, newest change and top modifiers
+# archive_candidates keeps only the highest stale folder in each branch
+rollup = FolderRollup(changes)
+folders = rollup.to_frame()
+candidates = rollup.archive_candidates('2015-01-01')
+print(candidates[['key', 'name', 'size_gb', 'file_count', 'newest_modified', 'top_modifiers']].head(25))
+
+# Later runs: keep the @odata.deltaLink from the last page and feed only what changed
+# rollup.apply_changes(pd.json_normalize(delta_page['value']))
+
 
@@ -0,0 +1,486 @@
+#Push based updates instead of re-listing the tenant on a schedule
+#  SubscriptionManager - creates / renews / removes Graph subscriptions (users, groups, drive roots)
+#  NotificationReceiver - local HTTP endpoint: answers the validationToken handshake, checks clientState,
+#                         acks with 202 and drops the notifications on a queue
+#  ChangeProcessor     - drains the queue in small batches, de-duplicates per resource and calls a handler
+#                         per resource kind (license rows, device rows, access matrix rows, folder rollups)
+#managedDevices has no Graph change notifications, poll_device_changes() polls only devices that synced
+#since the last check and feeds them into the same queue.
+#The receiver must be reachable by Graph over https (reverse proxy / tunnel in front of the local port).
+#send_test_notification() is a local stand-in for Graph for testing without a tenant.
+
+import datetime
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import pandas as pd
+import requests
+from sqlalchemy import inspect, text, bindparam
+
+from excel_output import read_table
+from folder_rollup import FolderRollup
+from graph_models import (DriveItem, ManagedDevice, SubscribedSku, DRIVE_FACETS, decode_one, decode_page,
+                          to_frame)
+from license_catalog import tenant_license_rows
+from site_access import ACCESS_COLUMNS, fetch_group_access, load_access_long, save_access_matrix
+from stale_devices import intune_device_rows
+
+GRAPH = "https://graph.microsoft.com/v1.0"
+
+# Max subscription lifetimes (minutes) per resource, from the Graph subscription docs
+MAX_MINUTES = {'users': 41760, 'groups': 41760, 'drive': 42300}
+RENEW_MARGIN = datetime.timedelta(hours=12)
+
+
+def resource_kind(resource):
+    r = resource.lower().lstrip('/')
+    if r.startswith('users'):
+        return 'users'
+    if r.startswith('groups'):
+        return 'groups'
+    if r.startswith('drives') or '/drive' in r:
+        return 'drive'
+    if r.startswith('devicemanagement/manageddevices'):
+        return 'devices'
+    return r.split('/')[0]
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _parse_ts(value):
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _request(method, url, headers, **kwargs):
+    while True:
+        resp = requests.request(method, url, headers=headers, **kwargs)
+        if resp.status_code == 429:
+            time.sleep(int(resp.headers.get('Retry-After', 10)))
+            continue
+        return resp
+
+
+class SubscriptionManager:
+    """
+    Keeps one subscription per resource alive and remembers them in a small json state file so a
+    restart reuses (and renews) the existing subscriptions instead of creating new ones.
+    """
+
+    def __init__(self, headers, notification_url, state_path='graph_subscriptions.json',
+                 lifecycle_url=None, client_state=None):
+        self.headers = headers
+        self.notification_url = notification_url
+        self.lifecycle_url = lifecycle_url
+        self.state_path = state_path
+        self.state = {'client_state': client_state or secrets.token_urlsafe(24), 'subscriptions': {}}
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+            if client_state:
+                self.state['client_state'] = client_state
+
+    @property
+    def client_state(self):
+        return self.state['client_state']
+
+    def subscription_ids(self):
+        return {s['id'] for s in self.state['subscriptions'].values()}
+
+    def _save(self):
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.state_path)
+
+    def _expiry(self, resource):
+        minutes = MAX_MINUTES.get(resource_kind(resource), 4230)
+        # a little under the max so clock skew doesn't get the request rejected
+        return (_utcnow() + datetime.timedelta(minutes=minutes - 30)).strftime('%Y-%m-%dT%H:%M:%S.0000000Z')
+
+    def ensure(self, resource, change_type='created,updated,deleted'):
+        """Creates the subscription if missing, renews it if it expires within RENEW_MARGIN."""
+        if resource_kind(resource) == 'drive':
+            change_type = 'updated'  # only change type driveItem subscriptions support
+        current = self.state['subscriptions'].get(resource)
+        if current and _parse_ts(current['expirationDateTime']) - _utcnow() > RENEW_MARGIN:
+            return current
+        if current:
+            renewed = self.renew(resource)
+            if renewed:
+                return renewed
+        body = {
+            'changeType': change_type,
+            'notificationUrl': self.notification_url,
+            'resource': resource,
+            'expirationDateTime': self._expiry(resource),
+            'clientState': self.client_state,
+        }
+        if self.lifecycle_url:
+            body['lifecycleNotificationUrl'] = self.lifecycle_url
+        resp = _request('POST', f"{GRAPH}/subscriptions", self.headers, json=body)
+        if resp.status_code != 201:
+            print(f"  ❌ Subscription for {resource} failed ({resp.status_code}): {resp.text[:200]}")
+            return None
+        sub = resp.json()
+        self.state['subscriptions'][resource] = {'id': sub['id'], 'expirationDateTime': sub['expirationDateTime'],
+                                                 'changeType': change_type}
+        self._save()
+        print(f"  Subscribed to {resource} until {sub['expirationDateTime']}")
+        return self.state['subscriptions'][resource]
+
+    def renew(self, resource):
+        current = self.state['subscriptions'].get(resource)
+        if not current:
+            return None
+        resp = _request('PATCH', f"{GRAPH}/subscriptions/{current['id']}", self.headers,
+                        json={'expirationDateTime': self._expiry(resource)})
+        if resp.status_code != 200:
+            # expired or deleted on the Graph side, ensure() will create a new one
+            del self.state['subscriptions'][resource]
+            self._save()
+            return None
+        current['expirationDateTime'] = resp.json()['expirationDateTime']
+        self._save()
+        return current
+
+    def renew_by_id(self, subscription_id):
+        for resource, sub in list(self.state['subscriptions'].items()):
+            if sub['id'] == subscription_id:
+                return self.renew(resource) or self.ensure(resource, sub.get('changeType', 'updated'))
+        return None
+
+    def renew_due(self):
+        for resource, sub in list(self.state['subscriptions'].items()):
+            self.ensure(resource, sub.get('changeType', 'updated'))
+
+    def retain(self, resources):
+        """Deletes remembered subscriptions for resources no longer wanted (e.g. a drive dropped from the list)."""
+        for resource in list(self.state['subscriptions']):
+            if resource not in resources:
+                self.remove(resource)
+
+    def remove(self, resource):
+        current = self.state['subscriptions'].pop(resource, None)
+        if current:
+            _request('DELETE', f"{GRAPH}/subscriptions/{current['id']}", self.headers)
+            self._save()
+
+    def run_renewals(self, stop_event, every=3600):
+        """Background loop: call from a thread, renews anything inside RENEW_MARGIN once an hour."""
+        while not stop_event.wait(every):
+            try:
+                self.renew_due()
+            except Exception as e:
+                print(f"  Renewal error: {e}")
+
+
+class NotificationReceiver:
+    """
+    Minimal Graph webhook endpoint.  POST /notifications and /lifecycle.
+    Validation: Graph POSTs ?validationToken=... and expects it echoed as text/plain within 10s.
+    Notifications with the wrong clientState or an unknown subscriptionId are dropped.
+    """
+
+    def __init__(self, client_state, subscription_ids=None, host='127.0.0.1', port=8765, on_lifecycle=None):
+        self.client_state = client_state
+        self.subscription_ids = subscription_ids  # callable returning the known ids, or None to skip check
+        self.queue = queue.Queue()
+        self.on_lifecycle = on_lifecycle
+        self.rejected = 0
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                params = parse_qs(urlsplit(self.path).query)
+                if 'validationToken' in params:
+                    token = params['validationToken'][0].encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain')
+                    self.send_header('Content-Length', str(len(token)))
+                    self.end_headers()
+                    self.wfile.write(token)
+                    return
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    payload = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+                # ack first, Graph retries / throttles endpoints that answer slowly
+                self.send_response(202)
+                self.end_headers()
+                receiver._accept(payload.get('value', []), lifecycle=urlsplit(self.path).path.endswith('lifecycle'))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self._thread = None
+
+    def _accept(self, notifications, lifecycle=False):
+        known = self.subscription_ids() if self.subscription_ids else None
+        for n in notifications:
+            if n.get('clientState') != self.client_state or (known is not None and n.get('subscriptionId') not in known):
+                self.rejected += 1
+                continue
+            if lifecycle or 'lifecycleEvent' in n:
+                if self.on_lifecycle:
+                    self.on_lifecycle(n)
+                continue
+            self.queue.put(n)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        print(f"Listening for Graph notifications on port {self.port}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ChangeProcessor:
+    """
+    Pulls notifications off the queue, waits batch_seconds to collect bursts, keeps one notification per
+    resource and hands each kind's batch to handlers[kind](notifications).
+    """
+
+    def __init__(self, notifications, handlers, batch_seconds=5):
+        self.queue = notifications
+        self.handlers = handlers
+        self.batch_seconds = batch_seconds
+        self.processed = defaultdict(int)
+        self.unhandled = defaultdict(int)
+
+    def drain(self, timeout=None):
+        try:
+            first = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return 0
+        batch = [first]
+        deadline = time.monotonic() + self.batch_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        by_kind = defaultdict(dict)
+        for n in batch:
+            # last change per resource wins, the handler re-reads current state anyway
+            by_kind[resource_kind(n.get('resource', ''))][n.get('resource')] = n
+        for kind, items in by_kind.items():
+            handler = self.handlers.get(kind)
+            if handler is None:
+                if not self.unhandled[kind]:
+                    print(f"  ⚠️ No handler for {kind} notifications, they are ignored")
+                self.unhandled[kind] += len(items)
+                continue
+            try:
+                handler(list(items.values()))
+                self.processed[kind] += len(items)
+            except Exception as e:
+                print(f"  ❌ {kind} handler failed: {e}")
+        return len(batch)
+
+    def run(self, stop_event):
+        while not stop_event.is_set():
+            self.drain(timeout=1)
+
+
+# ---- handlers ----
+
+def _resource_id(n):
+    data = n.get('resourceData') or {}
+    return data.get('id') or n.get('resource', '').rstrip('/').split('/')[-1].strip("'()")
+
+
+def replace_rows(engine, table, key_col, keys, rows):
+    """
+    Deletes the rows for keys and appends rows (the incremental form of to_sql(if_exists='replace')),
+    in one transaction so a failed insert doesn't leave the old rows deleted.
+    """
+    keys = list(keys)
+    with engine.begin() as conn:
+        if keys and inspect(conn).has_table(table):
+            stmt = text(f"DELETE FROM {table} WHERE {key_col} IN :keys").bindparams(bindparam('keys', expanding=True))
+            for start in range(0, len(keys), 1000):
+                conn.execute(stmt, {'keys': keys[start:start + 1000]})
+        if rows is not None and len(rows):
+            rows.to_sql(table, conn, if_exists='append', index=False)
+
+
+def make_license_handler(engine, headers, catalog, table='comp_365_licenses'):
+    """
+    users -> license assignments changed, so consumed units per SKU did too: re-reads /subscribedSkus
+    (one call per batch) and rebuilds comp_365_licenses with get_licenses.py's transform.
+    catalog: license_catalog.load_catalog(...)
+    """
+    def handle(notifications):
+        resp = _request('GET', f"{GRAPH}/subscribedSkus", headers)
+        if resp.status_code != 200:
+            raise RuntimeError(f"subscribedSkus: HTTP {resp.status_code} {resp.text[:200]}")
+        items, _, _ = decode_page(resp.content, SubscribedSku)
+        comp_365 = tenant_license_rows(to_frame(items, SubscribedSku), catalog)
+        with engine.begin() as conn:
+            comp_365.to_sql(table, conn, if_exists='replace', index=False)
+    return handle
+
+
+def make_group_access_handler(headers, sites_path, matrix_path):
+    """
+    groups -> re-reads owners/members of the changed groups that are in the site list (sites_path,
+    Sites_For_Permissioning.xlsx), swaps their rows in the long form and rewrites the access matrix
+    (matrix_path, Site_Access_Matrix.xlsx) the same way getusersfromsites.py builds it.
+    """
+    def get(url):
+        return _request('GET', url, headers)
+
+    def handle(notifications):
+        sites = read_table(sites_path)
+        names = dict(zip(sites['group_id'].astype(str).str.strip(), sites['name']))
+        changed = {_resource_id(n): n.get('changeType') for n in notifications}
+        changed = {g: c for g, c in changed.items() if g in names}
+        if not changed:
+            return
+        rows = []
+        for group_id, change_type in changed.items():
+            if change_type != 'deleted':
+                rows.extend(fetch_group_access(group_id, names[group_id], get))
+        long_df = load_access_long(matrix_path)
+        long_df = long_df[~long_df['group_id'].astype(str).isin(changed)]
+        long_df = pd.concat([long_df, pd.DataFrame(rows, columns=ACCESS_COLUMNS)], ignore_index=True)
+        save_access_matrix(long_df, matrix_path)
+    return handle
+
+
+def load_drive_rollup(headers, drive_ids):
+    """
+    Full root/delta listing of each drive -> (FolderRollup, {drive_id: deltaLink}) to start
+    make_drive_handler from, same listing as Review_Sharepoint.py.
+    """
+    frames, delta_links = [], {}
+    for drive_id in drive_ids:
+        url = (f"{GRAPH}/drives/{drive_id}/root/delta"
+               "?$select=id,name,size,file,folder,parentReference,lastModifiedDateTime,lastModifiedBy,deleted")
+        while url:
+            resp = _request('GET', url, headers)
+            if resp.status_code != 200:
+                raise RuntimeError(f"drive {drive_id} delta: HTTP {resp.status_code} {resp.text[:200]}")
+            items, url, delta_link = decode_page(resp.content, DriveItem)
+            frames.append(to_frame(items, DriveItem, facets=DRIVE_FACETS))
+            if delta_link:
+                delta_links[drive_id] = delta_link
+    items = pd.concat(frames, ignore_index=True) if frames else to_frame([], DriveItem, facets=DRIVE_FACETS)
+    return FolderRollup(items), delta_links
+
+
+def make_drive_handler(headers, rollup, delta_links, lock=None):
+    """
+    drive roots -> follows the stored deltaLink of each changed drive and applies only the changed
+    items to a folder_rollup.FolderRollup.  delta_links: dict drive_id -> last @odata.deltaLink.
+    lock: threading.Lock also held by whoever reads the rollup from another thread (archive_candidates).
+    """
+    lock = lock or threading.Lock()
+
+    def handle(notifications):
+        drive_ids = {n.get('resource', '').lstrip('/').split('/')[1] for n in notifications}
+        for drive_id in drive_ids:
+            url = delta_links.get(drive_id) or f"{GRAPH}/drives/{drive_id}/root/delta"
+            while url:
+                resp = _request('GET', url, headers)
+                if resp.status_code != 200:
+                    raise RuntimeError(f"drive {drive_id} delta: HTTP {resp.status_code} {resp.text[:200]}")
+                items, url, delta_link = decode_page(resp.content, DriveItem)
+                if items:
+                    changes = to_frame(items, DriveItem, facets=DRIVE_FACETS)
+                    with lock:
+                        rollup.apply_changes(changes)
+                if delta_link:
+                    delta_links[drive_id] = delta_link
+    return handle
+
+
+def make_device_handler(engine, headers, table='intune_devices', exclude_upns=None):
+    """
+    devices -> re-reads the changed managed devices and replaces their intune_devices rows, through
+    the same transform as managed_devices.py (user filter, last_sync_date, osVersionName).
+    """
+    def handle(notifications):
+        rows, keys = [], []
+        for n in notifications:
+            device_id = _resource_id(n)
+            keys.append(device_id)
+            if n.get('changeType') == 'deleted':
+                continue
+            resp = _request('GET', f"{GRAPH}/deviceManagement/managedDevices/{device_id}", headers)
+            if resp.status_code == 404:
+                continue  # gone since the notification, its row is just removed
+            if resp.status_code != 200:
+                raise RuntimeError(f"device {device_id}: HTTP {resp.status_code} {resp.text[:200]}")
+            rows.append(decode_one(resp.content, ManagedDevice))
+        frame = intune_device_rows(to_frame(rows, ManagedDevice), exclude_upns) if rows else None
+        replace_rows(engine, table, 'id', keys, frame)
+    return handle
+
+
+def poll_device_changes(headers, notifications, since, client_state):
+    """
+    managedDevices can't be subscribed to: list only devices that synced after `since` and put them on the
+    notification queue like a Graph notification would.  Returns the new high-water mark, raises
+    RuntimeError on a failed page so a partial listing never moves it past devices that weren't seen.
+    """
+    stamp = since.strftime('%Y-%m-%dT%H:%M:%SZ')
+    url = f"{GRAPH}/deviceManagement/managedDevices?$filter=lastSyncDateTime gt {stamp}&$select=id,lastSyncDateTime"
+    newest = since
+    while url:
+        resp = _request('GET', url, headers)
+        if resp.status_code != 200:
+            raise RuntimeError(f"managedDevices since {stamp}: HTTP {resp.status_code} {resp.text[:200]}")
+        data = resp.json()
+        for d in data.get('value', []):
+            notifications.put({'changeType': 'updated', 'clientState': client_state,
+                               'resource': f"deviceManagement/managedDevices('{d['id']}')",
+                               'resourceData': {'id': d['id']}})
+            newest = max(newest, _parse_ts(d['lastSyncDateTime']))
+        url = data.get('@odata.nextLink')
+    return newest
+
+
+# ---- local stand-in for Graph ----
+
+def send_test_notification(receiver_url, client_state, resource, change_type='updated',
+                           subscription_id='local-test', resource_id=None, validate=True):
+    """
+    Plays Graph's side against a running NotificationReceiver: the validation handshake, then one
+    change notification.  Returns the HTTP status of the notification post (202 when accepted).
+    """
+    if validate:
+        token = secrets.token_urlsafe(8)
+        resp = requests.post(f"{receiver_url}?validationToken={token}", timeout=10)
+        if resp.status_code != 200 or resp.text != token:
+            raise RuntimeError(f"Validation handshake failed: {resp.status_code} {resp.text!r}")
+    body = {'value': [{
+        'subscriptionId': subscription_id,
+        'clientState': client_state,
+        'changeType': change_type,
+        'resource': resource,
+        'resourceData': {'id': resource_id or resource.rstrip('/').split('/')[-1]},
+        'subscriptionExpirationDateTime': (_utcnow() + datetime.timedelta(days=1)).isoformat(),
+        'tenantId': 'local',
+    }]}
+    return requests.post(receiver_url, json=body, timeout=10).status_code
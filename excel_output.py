@@ -0,0 +1,224 @@
+#Streaming Excel output for the large review / matrix reports
+#DataFrame.to_excel builds the whole workbook in memory through openpyxl which gets very slow
+#past a few hundred thousand cells.  This writes rows straight to disk with xlsxwriter's
+#constant_memory mode, rolls over to a new sheet (or file) at Excel's row limit and drops a
+#parquet/csv sidecar next to the xlsx so the next stage doesn't have to re-parse the workbook.
+#Requires: pip install xlsxwriter (pyarrow optional, falls back to csv)
+
+import os
+import math
+import pandas as pd
+import xlsxwriter
+
+EXCEL_MAX_ROWS = 1048576
+CHUNK_ROWS = 50000
+
+
+def _cell(value):
+    #xlsxwriter can't take NA/NaN, lists or dicts (json_normalize leaves those behind)
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, (list, dict, tuple, set)):
+        return str(value)
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value
+
+
+def _chunks(data, columns=None):
+    #Yields DataFrames of at most CHUNK_ROWS rows from a DataFrame or an iterable of dict rows
+    if isinstance(data, pd.DataFrame):
+        for start in range(0, len(data), CHUNK_ROWS):
+            yield data.iloc[start:start + CHUNK_ROWS]
+        return
+    batch = []
+    for row in data:
+        batch.append(row)
+        if len(batch) >= CHUNK_ROWS:
+            yield pd.DataFrame(batch, columns=columns)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch, columns=columns)
+
+
+def sidecar_path(xlsx_path, fmt='parquet'):
+    stem, _ = os.path.splitext(xlsx_path)
+    return f"{stem}.{fmt}"
+
+
+def _frame_schema(df):
+    #Schema from the whole frame so a column that is empty in the first chunk but filled later
+    #still fits; columns that are null throughout become strings
+    import pyarrow as pa
+    df = df.map(lambda v: str(v) if isinstance(v, (list, dict, tuple, set)) else v)
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+    return schema
+
+
+class _SidecarWriter:
+    #Appends chunks to a parquet file (one row group per chunk) or a csv file
+
+    def __init__(self, xlsx_path, fmt='parquet'):
+        if fmt == 'parquet':
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                print("  pyarrow not installed, writing csv sidecar instead")
+                fmt = 'csv'
+        self.fmt = fmt
+        self.path = sidecar_path(xlsx_path, fmt)
+        self._writer = None
+        self._schema = None
+        self._as_text = False
+        self._header = True
+        self._created = False
+
+    def write(self, chunk):
+        if self.fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            chunk = chunk.map(lambda v: str(v) if isinstance(v, (list, dict, tuple, set)) else v)
+            if self._schema is None:
+                #Row iterables give no whole frame to infer from and every chunk can guess
+                #different types, so their columns are all kept as text
+                self._schema = pa.schema([(str(c), pa.string()) for c in chunk.columns])
+                self._as_text = True
+            if self._as_text:
+                chunk = chunk.astype(object).where(chunk.notna(), None).map(
+                    lambda v: v if v is None else str(v))
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, self._schema, compression='zstd')
+                self._created = True
+            self._writer.write_table(pa.Table.from_pandas(chunk, schema=self._schema, preserve_index=False))
+        else:
+            chunk.to_csv(self.path, mode='w' if self._header else 'a', header=self._header, index=False)
+            self._header = False
+            self._created = True
+
+    def close(self, columns=None):
+        #No rows: still leave an empty sidecar (header / schema only) so it reads back as no rows
+        if not self._created and columns is not None:
+            self.write(pd.DataFrame(columns=list(columns)))
+        if self._writer is not None:
+            self._writer.close()
+        if self._created:
+            #Stamp after the xlsx is closed so read_table treats the sidecar as current
+            os.utime(self.path, None)
+
+
+def write_excel_streaming(data, xlsx_path, sheet_name='Sheet1', columns=None,
+                          shard='sheets', sidecar='parquet', max_rows=EXCEL_MAX_ROWS):
+    """
+    Writes a DataFrame (or an iterable of dict rows) to xlsx in constant-memory mode.
+    Rows past max_rows roll over to '<sheet>_2', '<sheet>_3'... (shard='sheets')
+    or to '<file>_2.xlsx'... (shard='files').  sidecar='parquet'/'csv'/None.
+    Returns the list of xlsx files written.
+    """
+    if shard not in ('sheets', 'files'):
+        raise ValueError("shard must be 'sheets' or 'files'")
+    rows_per_sheet = max_rows - 1  # header row
+    options = {
+        'constant_memory': True,
+        'nan_inf_to_errors': True,
+        'remove_timezone': True,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+    }
+    stem, ext = os.path.splitext(xlsx_path)
+    files = [xlsx_path]
+    workbook = xlsxwriter.Workbook(xlsx_path, options)
+    header_fmt = workbook.add_format({'bold': True})
+    #Sidecars from an earlier run must never outlive this write (read_table would prefer them)
+    for fmt in ('parquet', 'csv'):
+        if os.path.exists(sidecar_path(xlsx_path, fmt)):
+            os.remove(sidecar_path(xlsx_path, fmt))
+    if columns is None and isinstance(data, pd.DataFrame):
+        columns = list(data.columns)
+    side = None
+    if sidecar:
+        side = _SidecarWriter(xlsx_path, sidecar)
+        if side.fmt == 'parquet' and isinstance(data, pd.DataFrame):
+            side._schema = _frame_schema(data)
+
+    shard_no = 1
+    worksheet = None
+    header = None
+    row_idx = 0
+    try:
+        for chunk in _chunks(data, columns):
+            if header is None:
+                header = [str(c) for c in chunk.columns]
+            if side is not None:
+                side.write(chunk)
+            for values in chunk.itertuples(index=False, name=None):
+                if worksheet is None or row_idx > rows_per_sheet:
+                    if worksheet is not None:
+                        shard_no += 1
+                        if shard == 'files':
+                            workbook.close()
+                            path = f"{stem}_{shard_no}{ext}"
+                            files.append(path)
+                            workbook = xlsxwriter.Workbook(path, options)
+                            header_fmt = workbook.add_format({'bold': True})
+                    name = sheet_name if shard == 'files' or shard_no == 1 else f"{sheet_name}_{shard_no}"
+                    worksheet = workbook.add_worksheet(name[:31])
+                    worksheet.write_row(0, 0, header, header_fmt)
+                    worksheet.freeze_panes(1, 0)
+                    row_idx = 1
+                worksheet.write_row(row_idx, 0, [_cell(v) for v in values])
+                row_idx += 1
+        if worksheet is None:
+            #Nothing to write, still leave a valid workbook with the header behind
+            worksheet = workbook.add_worksheet(sheet_name[:31])
+            if header is None and columns is not None:
+                header = list(columns)
+            if header:
+                worksheet.write_row(0, 0, header, header_fmt)
+    finally:
+        workbook.close()
+        if side is not None:
+            side.close(header if header is not None else columns)
+    #Drop '<file>_N.xlsx' shards left by an earlier, longer run so read_table doesn't pick them up
+    n = len(files) + 1
+    while os.path.exists(f"{stem}_{n}{ext}"):
+        os.remove(f"{stem}_{n}{ext}")
+        n += 1
+    return files
+
+
+def read_table(xlsx_path, sheet_name=0, sidecar='parquet'):
+    """
+    Reads the sidecar written by write_excel_streaming when it is at least as new as the xlsx,
+    otherwise falls back to the workbook itself (e.g. one someone edited by hand), including
+    every '<sheet>_2'... and '<file>_2.xlsx'... shard.
+    """
+    for fmt in ([sidecar] if sidecar else []) + ['csv']:
+        path = sidecar_path(xlsx_path, fmt)
+        if os.path.exists(path):
+            if os.path.exists(xlsx_path) and os.path.getmtime(path) < os.path.getmtime(xlsx_path):
+                continue
+            if fmt == 'parquet':
+                return pd.read_parquet(path)
+            return pd.read_csv(path)
+    return _read_excel_shards(xlsx_path, sheet_name)
+
+
+def _read_excel_shards(xlsx_path, sheet_name=0):
+    stem, ext = os.path.splitext(xlsx_path)
+    paths = [xlsx_path]
+    while os.path.exists(f"{stem}_{len(paths) + 1}{ext}"):
+        paths.append(f"{stem}_{len(paths) + 1}{ext}")
+    frames = []
+    for path in paths:
+        sheets = pd.read_excel(path, sheet_name=None)
+        base = list(sheets)[sheet_name] if isinstance(sheet_name, int) else sheet_name
+        frames.append(sheets[base])
+        n = 2
+        while f"{base}_{n}"[:31] in sheets:
+            frames.append(sheets[f"{base}_{n}"[:31]])
+            n += 1
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
@@ -1,12 +1,21 @@
 #Get the total available licenses for the tenant and how many are being utilized- check each user for what licenses are assigned to them
 
 import requests
+from time import sleep
 from msal import ConfidentialClientApplication
 import os
 import pandas as pd
 from sqlalchemy import create_engine
 from sqlalchemy.engine import URL
 from dotenv import load_dotenv,find_dotenv
+from snapshot_store import SnapshotStore
+from license_catalog import (load_catalog, tenant_license_rows, sku_utilization, plan_utilization,
+                             user_license_matrix)
+from graph_replay import enable_from_env
+from graph_models import LicenseDetail, SubscribedSku, User, decode_page, iter_pages, to_frame
+
+# GRAPH_HTTP_MODE=record/replay serves Graph calls from an archive for offline profiling (see graph_replay.py)
+enable_from_env()
 ##needs confirmation both usage report and individual licenses are being used to get license details
 
 
@@ -68,9 +77,9 @@ endpoint = "https://graph.microsoft.com/v1.0/subscribedSkus"
 http_headers = {'Authorization': 'Bearer ' + result['access_token'],
                 'Accept': 'application/json',
                 'Content-Type': 'application/json'}
-frames = []
-data = requests.get(endpoint, headers=http_headers, stream=False).json()
-df = pd.json_normalize(data['value'])
+resp = requests.get(endpoint, headers=http_headers, stream=False)
+items, _, _ = decode_page(resp.content, SubscribedSku)
+df = to_frame(items, SubscribedSku)
 
 
 connection_url = URL.create(
@@ -88,80 +97,34 @@ connection_url = URL.create(
 )
 engine = create_engine(connection_url)
 
-df2= df[['accountName', 'appliesTo', 'capabilityStatus', 'skuId', 'skuPartNumber',  'consumedUnits',  'prepaidUnits.enabled', 'prepaidUnits.suspended',
-       'prepaidUnits.warning', 'prepaidUnits.lockedOut']]
-df2.rename(columns={'skuId':'id'},inplace=True)
-print(df2.shape)
-dfnames= pd.read_csv('c:/users/public/Product names and service plan identifiers for licensing(2).csv')
-
-dfnames.drop_duplicates(subset=['GUID'],inplace=True)
-
-dfnames= dfnames[['GUID','Product_Display_Name', 'String_Id']]
-dfnames.rename(columns={'GUID':'id'},inplace=True)
-dfmerge =pd.merge(df2,dfnames,on='id',how='left')
-dfmerge.drop_duplicates(subset=['Product_Display_Name'],inplace=True)
-dfmerge.columns
-
-comp_365 = dfmerge[['accountName', 'appliesTo','Product_Display_Name','id',  'prepaidUnits.enabled', 'consumedUnits' ]]
-
-
-comp_365.columns = comp_365.columns.str.replace('.', '_')
-
-comp_365.columns = comp_365.columns.str.lower().str.replace(' ', '')
-
-
-
-comp_365['uid'] = range(1, len(comp_365) + 1)
+# Cached index of the product names csv, only re-parsed when the csv changes
+catalog = load_catalog('c:/users/public/Product names and service plan identifiers for licensing(2).csv')
+subscribed = df
+# Same transform the license change handler uses (listen_for_changes.py)
+comp_365 = tenant_license_rows(subscribed, catalog)
+print(comp_365.shape)
 
 comp_365.to_sql('comp_365_licenses', engine, if_exists='replace', index=False)
 
+#Keep a dated copy since the SQL table is replaced every run
+#consumption trend: store.query('comp_365_licenses', start='2026-01-01', columns=['product_display_name', 'consumedunits'])
+store = SnapshotStore(r"C:\Python_Scripts\api_calls\snapshots")
+store.write('comp_365_licenses', comp_365.drop(columns=['uid']), key='id')
+
 
 #Get users with licenses assigned
 
 
 
-frames=[]
-#ep = "https://graph.microsoft.com/v1.0/users?$filter=accountEnabled eq true&$select=id,userPrincipalName,assignedLicenses"
-ep = "https://graph.microsoft.com/v1.0/users?$filter=accountEnabled eq true"
+ep = "https://graph.microsoft.com/v1.0/users?$filter=accountEnabled eq true&$select=id,userPrincipalName"
 http_headers = {'Authorization': 'Bearer ' + result['access_token'],
                 'Accept': 'application/json',
                 'Content-Type': 'application/json'}
 
-data = requests.get(ep, headers=http_headers, stream=False).json()
-all_users = pd.json_normalize(data['value'])
-frames.append(all_users)
-        
-nextlink = data['@odata.nextLink']
-
-while True:
-    try:
-        data2 = requests.get(nextlink, headers=http_headers, stream=False).json()
-        nextlink = data2.get('@odata.nextLink')
-        print(len(nextlink))
-        au = pd.json_normalize(data2['value'])
-        frames.append(au)
-        
-        if not nextlink:
-            print('all users found')
-            break
-   
-    except TypeError:
-        print('all users found')
-        break
-    except TypeError:
-        print('Type')
-        break
-        
-df= pd.concat(frames)
-df.reset_index(inplace=True,drop=True)
-# all_lic = df[df['assignedLicenses'].apply(lambda x: len(x)>0)]
-# user_id = all_lic['id'].to_list()
-# principal = all_lic['userPrincipalName']
-# print(len(user_id))
-        
-# all_lic = all_users[all_users['assignedLicenses'].apply(lambda x: len(x)>0)]
-
-df = df[['userPrincipalName','id']]
+frames = [to_frame(users, User, columns=['userPrincipalName', 'id'])
+          for users in iter_pages(ep, http_headers, User)]
+df = pd.concat(frames, ignore_index=True)
+print('all users found')
 userids = df['id'].tolist()
 upns = df['userPrincipalName'].tolist()
 maxid = len(userids)
@@ -174,26 +137,35 @@ while number < maxid:
                 'Accept': 'application/json',
                 'Content-Type': 'application/json'}
 
-        data = requests.get(ep, headers=http_headers, stream=False).json()
-        lic = pd.json_normalize(data['value'])
+        resp = requests.get(ep, headers=http_headers, stream=False)
+        if resp.status_code == 429:
+            # throttled: wait and retry the same user instead of leaving them without licenses
+            sleep(int(resp.headers.get('Retry-After', 10)))
+            continue
+        items, _, _ = decode_page(resp.content, LicenseDetail)
+        lic = to_frame(items, LicenseDetail, columns=['skuId','skuPartNumber'])
         lic['upn']=upns[number]
         lic['id']=userids[number]
-        lic = lic[['id','skuPartNumber','upn']]
+        lic = lic[['id','skuId','skuPartNumber','upn']]
         lic_data.append(lic)
         number+=1
         if number % 100 == 0:
             print(number)
-    except Exception:
+    except Exception as e:
+        print(f"licenseDetails failed for {upns[number]}: {e}")
         number +=1
         if number % 100 == 0:
             print(number)
         
-lf = pd.concat(lic_data)
+lf = pd.concat(lic_data, ignore_index=True)
 lf['skuPartNumber'].value_counts()
-lf = pd.concat(lic_data)        
-dummies = pd.get_dummies(lf['skuPartNumber'])
-lf = lf.rename(columns={'skuPartNumber':'license'})
-# Concatenate the original DataFrame with the dummy columns
-lf = pd.concat([lf, dummies], axis=1)
-lf = lf.groupby('upn').max().reset_index()
-del lf['license']
+user_skus = lf.rename(columns={'id':'user_id','skuId':'sku_id'})
+
+# Consumed vs prepaid per SKU and per service plan across all users
+sku_rollup = sku_utilization(subscribed, catalog, user_skus)
+plan_rollup = plan_utilization(subscribed, catalog, user_skus)
+print(sku_rollup.head(20))
+print(plan_rollup.head(20))
+
+# One row per user, one True/False column per license
+lf = user_license_matrix(user_skus)
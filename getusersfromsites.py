@@ -1,5 +1,11 @@
 
 import os
+from excel_output import write_excel_streaming, read_table
+from graph_replay import enable_from_env
+from site_access import fetch_group_access, save_access_matrix
+
+# GRAPH_HTTP_MODE=record/replay serves Graph calls from an archive for offline profiling (see graph_replay.py)
+enable_from_env()
 #Requires api auth to be set up
 #This is a process to gather information on several sites and then the users and their permissions on those sites. 
 # 1. Clean Dataframe
@@ -46,7 +52,7 @@ os.makedirs(output_dir, exist_ok=True)
 # Naming it 'Sites_For_Permissioning.xlsx' for use in PowerShell script
 output_path = os.path.join(output_dir, "Sites_For_Permissioning.xlsx")
 
-df_sites.to_excel(output_path, index=False)
+write_excel_streaming(df_sites, output_path)
 
 print("\n" + "="*60)
 print(f"Static file created: {output_path}")
@@ -69,7 +75,7 @@ if not os.path.exists(static_file_path):
     print(f"File not found: {static_file_path}")
     print("Please run the previous cell to generate the static site list.")
 else:
-    df_target = pd.read_excel(static_file_path)
+    df_target = read_table(static_file_path)
     print(f"Loaded {len(df_target)} sites from static file.")
 
     all_site_users = []
@@ -85,61 +91,24 @@ else:
         
         group_id = site_id 
         
-        # Get Owners
-        owners_url = f"https://graph.microsoft.com/v1.0/groups/{group_id}/owners"
-        owners_resp = graph_get(owners_url)
-        
-        if getattr(owners_resp, 'status_code', None) == 200:
-            data = owners_resp.json()
-            users = data.get('value', [])
-            print(f"  Found {len(users)} owners")
-            for u in users:
-                all_site_users.append({
-                    'user_email': u.get('mail', u.get('userPrincipalName')),
-                    'user_displayName': u.get('displayName'),
-                    'user_id': u.get('id'),
-                    'site_name': site_name,
-                    'role': 'Owner'
-                })
-        else:
-            print(f"  Failed to get owners (Status: {getattr(owners_resp, 'status_code', 'N/A')})")
-
-        # Get Members
-        members_url = f"https://graph.microsoft.com/v1.0/groups/{group_id}/members"
-        members_resp = graph_get(members_url)
-        
-        if getattr(members_resp, 'status_code', None) == 200:
-            data = members_resp.json()
-            users = data.get('value', [])
-            print(f"  Found {len(users)} members")
-            for u in users:
-                all_site_users.append({
-                    'user_email': u.get('mail', u.get('userPrincipalName')),
-                    'user_displayName': u.get('displayName'),
-                    'user_id': u.get('id'),
-                    'site_name': site_name,
-                    'role': 'Member'
-                })
-        else:
-            print(f"  Failed to get members (Status: {getattr(members_resp, 'status_code', 'N/A')})")
+        # Owners and members (all pages), kept with group_id so listen_for_changes.py can refresh single groups
+        try:
+            rows = fetch_group_access(group_id, site_name, graph_get)
+        except RuntimeError as e:
+            print(f"  {e}")
+            continue
+        print(f"  Found {sum(r['role'] == 'Owner' for r in rows)} owners, "
+              f"{sum(r['role'] == 'Member' for r in rows)} members")
+        all_site_users.extend(rows)
 
     # 3. Create Pivot Table
     if all_site_users:
         long_df = pd.DataFrame(all_site_users)
-        long_df['role_rank'] = long_df['role'].map({'Owner': 1, 'Member': 2})
-        long_df = long_df.sort_values('role_rank').drop_duplicates(subset=['user_email', 'site_name'], keep='first')
-        
-        pivot_df = long_df.pivot_table(
-            index=['user_displayName', 'user_email', 'user_id'],
-            columns='site_name',
-            values='role',
-            aggfunc='first',
-            fill_value='Visitor'
-        ).reset_index()
 
         out_path = r"C:\Python_Scripts\api_calls\reports\Site_Access_Matrix.xlsx"
         
-        pivot_df.to_excel(out_path, index=False)
+        # Writes the matrix and the long form next to it (Site_Access_Matrix_Long.xlsx)
+        pivot_df = save_access_matrix(long_df, out_path)
         print(f"\nMatrix saved: {out_path}")
         display(pivot_df.head())
     else:
@@ -0,0 +1,309 @@
+#Typed, slotted models for the Graph entities these scripts use, decoded straight from response bytes
+#Only the declared fields are kept, everything else in the payload is skipped by the decoder instead of
+#being built into dicts and then thrown away by json_normalize / column selection.
+#Uses msgspec's compiled decoder when installed (pip install msgspec), otherwise json + a per-model
+#field plan built once.  Field names follow Graph (camelCase) so to_frame() gives the same dotted
+#column names as pd.json_normalize, e.g. 'prepaidUnits.enabled', 'lastModifiedBy.user.email'.
+#Counts are Optional[int]: Graph sends null for some of them and msgspec rejects null for a plain int.
+
+import dataclasses
+import json
+import time
+import typing
+from dataclasses import dataclass
+from operator import attrgetter
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import requests
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+# ---- shared facets ----
+
+@dataclass(slots=True)
+class IdentityUser:
+    id: Optional[str] = None
+    displayName: Optional[str] = None
+    email: Optional[str] = None
+
+
+@dataclass(slots=True)
+class IdentitySet:
+    user: Optional[IdentityUser] = None
+
+
+@dataclass(slots=True)
+class ItemReference:
+    driveId: Optional[str] = None
+    id: Optional[str] = None
+    path: Optional[str] = None
+
+
+@dataclass(slots=True)
+class FolderFacet:
+    childCount: Optional[int] = None
+
+
+@dataclass(slots=True)
+class FileFacet:
+    mimeType: Optional[str] = None
+
+
+@dataclass(slots=True)
+class DeletedFacet:
+    state: Optional[str] = None
+
+
+@dataclass(slots=True)
+class SignInActivity:
+    lastSignInDateTime: Optional[str] = None
+    lastNonInteractiveSignInDateTime: Optional[str] = None
+
+
+@dataclass(slots=True)
+class PrepaidUnits:
+    enabled: Optional[int] = None
+    suspended: Optional[int] = None
+    warning: Optional[int] = None
+    lockedOut: Optional[int] = None
+
+
+@dataclass(slots=True)
+class ServicePlanInfo:
+    servicePlanId: Optional[str] = None
+    servicePlanName: Optional[str] = None
+    provisioningStatus: Optional[str] = None
+    appliesTo: Optional[str] = None
+
+
+# ---- entities ----
+
+@dataclass(slots=True)
+class User:
+    id: Optional[str] = None
+    displayName: Optional[str] = None
+    mail: Optional[str] = None
+    userPrincipalName: Optional[str] = None
+    accountEnabled: Optional[bool] = None
+    signInActivity: Optional[SignInActivity] = None
+
+    @property
+    def email(self):
+        #mail is null (not missing) for many accounts, so .get('mail', upn) never fell back
+        return self.mail or self.userPrincipalName
+
+
+@dataclass(slots=True)
+class DriveItem:
+    id: Optional[str] = None
+    name: Optional[str] = None
+    size: Optional[int] = None
+    webUrl: Optional[str] = None
+    createdDateTime: Optional[str] = None
+    lastModifiedDateTime: Optional[str] = None
+    lastModifiedBy: Optional[IdentitySet] = None
+    parentReference: Optional[ItemReference] = None
+    folder: Optional[FolderFacet] = None
+    file: Optional[FileFacet] = None
+    deleted: Optional[DeletedFacet] = None
+
+
+@dataclass(slots=True)
+class ManagedDevice:
+    id: Optional[str] = None
+    userId: Optional[str] = None
+    deviceName: Optional[str] = None
+    managedDeviceOwnerType: Optional[str] = None
+    enrolledDateTime: Optional[str] = None
+    lastSyncDateTime: Optional[str] = None
+    operatingSystem: Optional[str] = None
+    complianceState: Optional[str] = None
+    osVersion: Optional[str] = None
+    azureADRegistered: Optional[bool] = None
+    deviceEnrollmentType: Optional[str] = None
+    emailAddress: Optional[str] = None
+    azureADDeviceId: Optional[str] = None
+    deviceCategoryDisplayName: Optional[str] = None
+    isSupervised: Optional[bool] = None
+    isEncrypted: Optional[bool] = None
+    userPrincipalName: Optional[str] = None
+    model: Optional[str] = None
+    manufacturer: Optional[str] = None
+    complianceGracePeriodExpirationDateTime: Optional[str] = None
+    serialNumber: Optional[str] = None
+    userDisplayName: Optional[str] = None
+    wiFiMacAddress: Optional[str] = None
+
+
+@dataclass(slots=True)
+class SubscribedSku:
+    accountName: Optional[str] = None
+    appliesTo: Optional[str] = None
+    capabilityStatus: Optional[str] = None
+    skuId: Optional[str] = None
+    skuPartNumber: Optional[str] = None
+    consumedUnits: Optional[int] = None
+    prepaidUnits: Optional[PrepaidUnits] = None
+
+
+@dataclass(slots=True)
+class LicenseDetail:
+    id: Optional[str] = None
+    skuId: Optional[str] = None
+    skuPartNumber: Optional[str] = None
+    servicePlans: List[ServicePlanInfo] = dataclasses.field(default_factory=list)
+
+
+# presence flags FolderRollup needs from a DriveItem frame (see to_frame)
+DRIVE_FACETS = ('file', 'deleted')
+
+
+# ---- decoding ----
+
+class GraphError(Exception):
+    """A Graph error body ({"error": {...}}) where a collection page was expected."""
+
+    def __init__(self, error):
+        error = error or {}
+        self.code = error.get('code')
+        super().__init__(f"{self.code}: {error.get('message')}")
+
+
+_decoders = {}
+
+
+def _page_decoder(model):
+    dec = _decoders.get(('page', model))
+    if dec is None:
+        if msgspec is not None:
+            page = msgspec.defstruct(f'{model.__name__}Page',
+                                     [('value', Optional[List[model]], None), ('next_link', Optional[str], None),
+                                      ('delta_link', Optional[str], None), ('error', Optional[dict], None)],
+                                     rename={'next_link': '@odata.nextLink', 'delta_link': '@odata.deltaLink'})
+            msg_dec = msgspec.json.Decoder(page, strict=False)
+
+            def dec(content):
+                p = msg_dec.decode(content)
+                if p.value is None and p.error is not None:
+                    raise GraphError(p.error)
+                return p.value or [], p.next_link, p.delta_link
+        else:
+            build = _builder(model)
+
+            def dec(content):
+                data = json.loads(content)
+                if 'value' not in data and 'error' in data:
+                    raise GraphError(data['error'])
+                return ([build(v) for v in data.get('value', [])],
+                        data.get('@odata.nextLink'), data.get('@odata.deltaLink'))
+        _decoders[('page', model)] = dec
+    return dec
+
+
+def _builder(model):
+    """json fallback: a constructor that keeps only the model's fields, planned once per model."""
+    hints = typing.get_type_hints(model)
+    plan = []
+    for f in dataclasses.fields(model):
+        hint = hints[f.name]
+        args = [a for a in typing.get_args(hint) if a is not type(None)]
+        inner = args[0] if typing.get_origin(hint) is typing.Union and args else hint
+        if dataclasses.is_dataclass(inner):
+            plan.append((f.name, 'one', _builder(inner)))
+        elif typing.get_origin(inner) in (list, List) and dataclasses.is_dataclass(typing.get_args(inner)[0]):
+            plan.append((f.name, 'many', _builder(typing.get_args(inner)[0])))
+        else:
+            plan.append((f.name, None, None))
+
+    def build(data):
+        kwargs = {}
+        for name, kind, sub in plan:
+            if name not in data:
+                continue
+            v = data[name]
+            if kind == 'one' and v is not None:
+                v = sub(v)
+            elif kind == 'many' and v is not None:
+                v = [sub(x) for x in v]
+            kwargs[name] = v
+        return model(**kwargs)
+    return build
+
+
+def decode_page(content, model):
+    """
+    Response bytes of a collection -> (items, nextLink, deltaLink).
+    Raises GraphError for an error body (throttling, auth ...) instead of returning an empty page.
+    """
+    return _page_decoder(model)(content)
+
+
+def decode_one(content, model):
+    """Response bytes of a single entity (GET .../{id}) -> model instance."""
+    dec = _decoders.get(('one', model))
+    if dec is None:
+        if msgspec is not None:
+            dec = msgspec.json.Decoder(model, strict=False).decode
+        else:
+            build = _builder(model)
+
+            def dec(content):
+                return build(json.loads(content))
+        _decoders[('one', model)] = dec
+    return dec(content)
+
+
+def iter_pages(url, headers, model):
+    """GETs url and every @odata.nextLink, waiting out 429s, yielding decoded items per page."""
+    while url:
+        resp = requests.get(url, headers=headers)
+        if resp.status_code == 429:
+            time.sleep(int(resp.headers.get('Retry-After', 10)))
+            continue
+        resp.raise_for_status()
+        items, url, _ = decode_page(resp.content, model)
+        yield items
+
+
+# ---- to pandas ----
+
+def _flatten(values, model, prefix, out, wanted):
+    #one attribute pass per field per level, nested facets are walked once for all their columns
+    hints = typing.get_type_hints(model)
+    for f in dataclasses.fields(model):
+        name = f'{prefix}{f.name}'
+        hint = hints[f.name]
+        args = [a for a in typing.get_args(hint) if a is not type(None)]
+        inner = args[0] if typing.get_origin(hint) is typing.Union and args else hint
+        nested = dataclasses.is_dataclass(inner)
+        if wanted is not None and not any(w == name or (nested and w.startswith(name + '.')) for w in wanted):
+            continue
+        get = attrgetter(f.name)
+        col = [None if v is None else get(v) for v in values]
+        if nested:
+            _flatten(col, inner, name + '.', out, wanted)
+        else:
+            out[name] = col
+
+
+def to_frame(items, model, columns=None, facets=()):
+    """
+    DataFrame with json_normalize style dotted columns built column-by-column from the models.
+    columns limits the output (and the work) to the listed dotted names.
+    facets adds a bool column per listed nested field, True where the facet is present at all:
+    "deleted": {} has no non-null sub-field, so only the flag tells it apart from a missing facet.
+    """
+    out = {}
+    _flatten(items, model, '', out, set(columns) if columns is not None else None)
+    names = list(columns) if columns is not None else list(out)
+    for facet in facets:
+        get = attrgetter(facet)
+        out[facet] = np.fromiter((get(v) is not None for v in items), dtype=bool, count=len(items))
+        names.append(facet)
+    return pd.DataFrame(out, columns=names)
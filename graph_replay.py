@@ -0,0 +1,209 @@
+#Record / replay of every HTTP call (Graph + msal token calls) at the requests transport level
+#Record once against the tenant, then profile the pandas / SQL / Excel stages offline from the archive.
+#  GRAPH_HTTP_MODE=record GRAPH_HTTP_ARCHIVE=graph_calls.jsonl.gz python get_licenses.py
+#  GRAPH_HTTP_MODE=replay GRAPH_HTTP_ARCHIVE=graph_calls.jsonl.gz python get_licenses.py
+#  GRAPH_HTTP_LATENCY=1 also sleeps the recorded response time on replay (0.5 = half speed network etc)
+#Request headers are never stored, token/secret fields are scrubbed from urls, bodies and responses,
+#including the tempauth / sig tokens of pre-authenticated download and redirect urls.
+
+import base64
+import gzip
+import io
+import hashlib
+import json
+import os
+import re
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+SECRET_FIELDS = ('access_token', 'refresh_token', 'id_token', 'client_secret', 'client_assertion',
+                 'password')
+# 'code' is an auth code in token form posts / redirect urls, but in Graph json it is the error code
+FORM_SECRET_FIELDS = SECRET_FIELDS + ('code',)
+# pre-authenticated SharePoint / storage urls (download urls, report redirects) carry their token here
+URL_SECRET_PARAMS = ('tempauth', 'sig', 'skoid', 'sv')
+KEEP_RESPONSE_HEADERS = ('content-type', 'retry-after', 'location')
+REDACTED = 'REDACTED'
+
+_SECRET_JSON = re.compile(r'("(?:%s)"\s*:\s*)"[^"]*"' % '|'.join(SECRET_FIELDS))
+_DOWNLOAD_URL_JSON = re.compile(r'("@(?:microsoft\.graph|content)\.downloadUrl"\s*:\s*)"([^"]*)"')
+# also inside csv report bodies and json-escaped urls (\u0026 instead of &)
+_URL_SECRET_TEXT = re.compile(r'(?i)(?:(?<![A-Za-z0-9_])|(?<=\\u0026))((?:%s)=)[^&"\s\\]+'
+                              % '|'.join(URL_SECRET_PARAMS))
+
+
+class ReplayMiss(requests.exceptions.ConnectionError):
+    """Raised in replay mode when a request was never recorded."""
+
+
+def _scrub_json_text(text):
+    text = _SECRET_JSON.sub(lambda m: f'{m.group(1)}"{REDACTED}"', text)
+    text = _DOWNLOAD_URL_JSON.sub(lambda m: f'{m.group(1)}"{_scrub_url(m.group(2))}"', text)
+    return _URL_SECRET_TEXT.sub(lambda m: f'{m.group(1)}{REDACTED}', text)
+
+
+def _scrub_form(body):
+    pairs = parse_qsl(body, keep_blank_values=True)
+    return urlencode([(k, REDACTED if k in FORM_SECRET_FIELDS else v) for k, v in pairs])
+
+
+def _scrub_url(url):
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = urlencode([(k, REDACTED if k in FORM_SECRET_FIELDS or k.lower() in URL_SECRET_PARAMS else v)
+                       for k, v in parse_qsl(parts.query, keep_blank_values=True)])
+    return urlunsplit(parts._replace(query=query))
+
+
+def _body_text(body):
+    if body is None:
+        return ''
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='replace')
+    return body
+
+
+def request_key(method, url, body):
+    """Method + url with sorted query + hash of the scrubbed body (token posts differ only in secrets)."""
+    parts = urlsplit(_scrub_url(url))
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    url = urlunsplit(parts._replace(query=query))
+    body = _body_text(body)
+    if body:
+        body = _scrub_json_text(body) if body.lstrip().startswith(('{', '[')) else _scrub_form(body)
+    digest = hashlib.sha1(body.encode('utf-8')).hexdigest()[:16] if body else ''
+    return f"{method.upper()} {url} {digest}"
+
+
+class GraphRecorder:
+    """
+    mode='record': passes requests through and keeps a scrubbed copy of every exchange,
+                   written as gzipped json lines on uninstall().
+    mode='replay': answers from the archive without touching the network. Repeated identical
+                   requests get the recorded responses in order (the last one repeats).
+    """
+
+    def __init__(self, archive, mode='replay', latency=0.0):
+        if mode not in ('record', 'replay'):
+            raise ValueError("mode must be 'record' or 'replay'")
+        self.archive = archive
+        self.mode = mode
+        self.latency = float(latency or 0)
+        self._original_send = None
+        self._records = []
+        self._responses = defaultdict(deque)
+        if mode == 'replay':
+            self._load()
+
+    # ---- archive ----
+
+    def _load(self):
+        with gzip.open(self.archive, 'rt', encoding='utf-8') as f:
+            for line in f:
+                rec = json.loads(line)
+                self._responses[rec['key']].append(rec)
+        print(f"Replaying {sum(len(v) for v in self._responses.values())} recorded responses from {self.archive}")
+
+    def save(self):
+        tmp = self.archive + '.tmp'
+        with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=6) as f:
+            for rec in self._records:
+                f.write(json.dumps(rec, separators=(',', ':')) + '\n')
+        os.replace(tmp, self.archive)
+        print(f"Recorded {len(self._records)} responses to {self.archive}")
+
+    # ---- transport ----
+
+    def _record(self, adapter, request, **kwargs):
+        start = time.perf_counter()
+        response = self._original_send(adapter, request, **kwargs)
+        content = response.content  # reads the body so it can be stored and still used by the caller
+        elapsed = time.perf_counter() - start
+        ctype = response.headers.get('Content-Type', '')
+        if 'json' in ctype or 'text' in ctype or 'csv' in ctype:
+            body, encoding = _scrub_json_text(content.decode('utf-8', errors='replace')), 'text'
+        else:
+            body, encoding = base64.b64encode(content).decode('ascii'), 'base64'
+        self._records.append({
+            'key': request_key(request.method, request.url, request.body),
+            'url': _scrub_url(request.url),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {k: _scrub_url(v) if k.lower() == 'location' else v
+                        for k, v in response.headers.items() if k.lower() in KEEP_RESPONSE_HEADERS},
+            'body': body,
+            'encoding': encoding,
+            'elapsed': round(elapsed, 4),
+        })
+        return response
+
+    def _replay(self, adapter, request, **kwargs):
+        key = request_key(request.method, request.url, request.body)
+        queue = self._responses.get(key)
+        if not queue:
+            raise ReplayMiss(f"No recorded response for {key}", request=request)
+        rec = queue.popleft() if len(queue) > 1 else queue[0]
+        if self.latency:
+            time.sleep(rec['elapsed'] * self.latency)
+        response = requests.Response()
+        response.status_code = rec['status']
+        response.reason = rec.get('reason')
+        response.headers = CaseInsensitiveDict(rec['headers'])
+        response._content = (rec['body'].encode('utf-8') if rec['encoding'] == 'text'
+                             else base64.b64decode(rec['body']))
+        response._content_consumed = True
+        response.raw = io.BytesIO(response._content)
+        response.encoding = 'utf-8' if rec['encoding'] == 'text' else None
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=rec['elapsed'])
+        response.connection = adapter
+        return response
+
+    def install(self):
+        if self._original_send is not None:
+            return self
+        self._original_send = HTTPAdapter.send
+        handler = self._record if self.mode == 'record' else self._replay
+
+        def send(adapter, request, **kwargs):
+            return handler(adapter, request, **kwargs)
+        HTTPAdapter.send = send
+        return self
+
+    def uninstall(self):
+        if self._original_send is None:
+            return
+        HTTPAdapter.send = self._original_send
+        self._original_send = None
+        if self.mode == 'record':
+            self.save()
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+
+def enable_from_env():
+    """
+    Installs a GraphRecorder when GRAPH_HTTP_MODE is record/replay, otherwise does nothing.
+    Recording is saved when the interpreter exits.
+    """
+    mode = os.getenv('GRAPH_HTTP_MODE', '').lower()
+    if mode not in ('record', 'replay'):
+        return None
+    archive = os.getenv('GRAPH_HTTP_ARCHIVE', 'graph_calls.jsonl.gz')
+    recorder = GraphRecorder(archive, mode=mode, latency=os.getenv('GRAPH_HTTP_LATENCY', 0)).install()
+    if mode == 'record':
+        import atexit
+        atexit.register(recorder.uninstall)
+    return recorder
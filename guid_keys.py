@@ -0,0 +1,106 @@
+#Compact GUID keys
+#Graph ids (user id/userId, skuId, azureADDeviceId, site/drive/group ids) arrive as 36 character strings.
+#As object columns that is ~90 bytes per cell and every merge / drop_duplicates hashes the full string.
+#parse_guids turns a column into two uint64 arrays (the 128 bits) in one vectorized pass, and
+#GuidRegistry interns those into dense int32 codes that can be shared by every frame in a run, so
+#joins / dedups / group-bys work on int32 and ids are only turned back into text on output.
+
+import numpy as np
+import pandas as pd
+
+_HEX_VALUE = np.full(256, 255, dtype=np.uint8)
+for _i, _c in enumerate(b'0123456789abcdef'):
+    _HEX_VALUE[_c] = _i
+for _i, _c in enumerate(b'ABCDEF'):
+    _HEX_VALUE[_c] = _i + 10
+_HEX_CHAR = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+
+# positions of the 32 hex digits and 4 dashes in 8-4-4-4-12
+_DASHES = np.array([8, 13, 18, 23])
+_DIGITS = np.setdiff1d(np.arange(36), _DASHES)
+
+
+def parse_guids(values):
+    """
+    Returns (hi, lo, valid): big-endian halves of each GUID as uint64 arrays plus a mask.
+    Missing or malformed values come back as 0/0 with valid=False.  Braces and case are ignored.
+    """
+    s = pd.Series(values, copy=False).astype('string').str.strip().str.strip('{}')
+    right_len = (s.str.len() == 36).fillna(False).to_numpy(dtype=bool)
+    raw = np.array(s.where(right_len, '').str.encode('ascii', errors='replace').fillna(b'').tolist(), dtype='S36')
+    chars = raw.view(np.uint8).reshape(len(raw), 36) if len(raw) else np.zeros((0, 36), dtype=np.uint8)
+    nibbles = _HEX_VALUE[chars[:, _DIGITS]]
+    valid = right_len & (nibbles != 255).all(axis=1) & (chars[:, _DASHES] == ord('-')).all(axis=1)
+    nibbles[~valid] = 0
+    packed = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+    halves = np.ascontiguousarray(packed).view('>u8').astype(np.uint64)
+    return halves[:, 0].copy(), halves[:, 1].copy(), valid
+
+
+def format_guids(hi, lo):
+    """Inverse of parse_guids: lowercase 8-4-4-4-12 strings (object array)."""
+    n = len(hi)
+    packed = np.empty((n, 2), dtype='>u8')
+    packed[:, 0] = hi
+    packed[:, 1] = lo
+    octets = packed.view(np.uint8).reshape(n, 16)
+    chars = np.full((n, 36), ord('-'), dtype=np.uint8)
+    chars[:, _DIGITS[0::2]] = _HEX_CHAR[octets >> 4]
+    chars[:, _DIGITS[1::2]] = _HEX_CHAR[octets & 0x0F]
+    return np.char.decode(chars.view('S36').reshape(n), 'ascii').astype(object)
+
+
+class GuidRegistry:
+    """
+    Interns GUIDs into dense int32 codes (-1 = missing/invalid).  Use one registry for every frame
+    that gets joined together so equal ids get equal codes across users, devices, SKUs and sites.
+    """
+
+    def __init__(self):
+        self._hi = np.empty(0, dtype=np.uint64)
+        self._lo = np.empty(0, dtype=np.uint64)
+        self._lookup = pd.MultiIndex.from_arrays([self._hi, self._lo])
+
+    def __len__(self):
+        return len(self._hi)
+
+    @property
+    def nbytes(self):
+        return self._hi.nbytes + self._lo.nbytes
+
+    def encode(self, values, add=True):
+        hi, lo, valid = parse_guids(values)
+        probe = pd.MultiIndex.from_arrays([hi, lo])
+        codes = self._lookup.get_indexer(probe) if len(self) else np.full(len(hi), -1, dtype=np.intp)
+        new = (codes == -1) & valid
+        if add and new.any():
+            fresh = pd.MultiIndex.from_arrays([hi[new], lo[new]]).unique()
+            self._hi = np.concatenate([self._hi, fresh.get_level_values(0).to_numpy(np.uint64)])
+            self._lo = np.concatenate([self._lo, fresh.get_level_values(1).to_numpy(np.uint64)])
+            self._lookup = pd.MultiIndex.from_arrays([self._hi, self._lo])
+            codes[new] = self._lookup.get_indexer(probe[new])
+        codes[~valid] = -1
+        return codes.astype(np.int32)
+
+    def decode(self, codes):
+        codes = np.asarray(codes)
+        missing = codes < 0
+        safe = np.where(missing, 0, codes)
+        out = format_guids(self._hi[safe], self._lo[safe]) if len(self) else np.full(len(codes), None, dtype=object)
+        out[missing] = None
+        return out
+
+    def encode_columns(self, df, columns):
+        """Copy of df with the given GUID columns replaced by int32 codes."""
+        out = df.copy()
+        for col in columns:
+            if col in out.columns:
+                out[col] = self.encode(out[col])
+        return out
+
+    def decode_columns(self, df, columns):
+        out = df.copy()
+        for col in columns:
+            if col in out.columns:
+                out[col] = self.decode(out[col].to_numpy())
+        return out
@@ -0,0 +1,193 @@
+#Cached index over Microsoft's "Product names and service plan identifiers for licensing" csv
+#https://learn.microsoft.com/en-us/entra/identity/users/licensing-service-plan-reference
+#The csv has one row per (SKU, service plan).  It is parsed once into SKU / plan lookup tables
+#and cached as json next to the csv; the cache is only rebuilt when the csv changes.
+#json rather than pickle: the csv lives in a shared folder and loading a pickle from there would
+#run whatever anyone with write access put in it.
+
+import os
+import hashlib
+import json
+import pandas as pd
+
+CATALOG_VERSION = 2
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class LicenseCatalog:
+    """
+    skus:      index GUID -> Product_Display_Name, String_Id
+    plans:     index Service_Plan_Id -> Service_Plan_Name, Service_Plan_Friendly_Name
+    sku_plans: one row per (sku_id, plan_id)
+    """
+
+    def __init__(self, skus, plans, sku_plans, digest=None):
+        self.skus = skus
+        self.plans = plans
+        self.sku_plans = sku_plans
+        self.digest = digest
+        # plain dicts for O(1) single lookups in loops
+        self._sku_lookup = skus.to_dict('index')
+        self._plan_lookup = plans.to_dict('index')
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        raw = pd.read_csv(csv_path, dtype=str, encoding_errors='replace')
+        raw.columns = raw.columns.str.strip()
+        raw['GUID'] = raw['GUID'].str.strip().str.lower()
+        raw['Service_Plan_Id'] = raw['Service_Plan_Id'].str.strip().str.lower()
+
+        skus = (raw[['GUID', 'Product_Display_Name', 'String_Id']]
+                .drop_duplicates(subset=['GUID'])
+                .set_index('GUID'))
+        plans = (raw[['Service_Plan_Id', 'Service_Plan_Name', 'Service_Plans_Included_Friendly_Names']]
+                 .rename(columns={'Service_Plans_Included_Friendly_Names': 'Service_Plan_Friendly_Name'})
+                 .drop_duplicates(subset=['Service_Plan_Id'])
+                 .set_index('Service_Plan_Id'))
+        sku_plans = (raw[['GUID', 'Service_Plan_Id']]
+                     .rename(columns={'GUID': 'sku_id', 'Service_Plan_Id': 'plan_id'})
+                     .drop_duplicates()
+                     .reset_index(drop=True))
+        return cls(skus, plans, sku_plans)
+
+    def sku(self, guid):
+        return self._sku_lookup.get(str(guid).lower())
+
+    def plan(self, guid):
+        return self._plan_lookup.get(str(guid).lower())
+
+    def sku_name(self, guid, default=None):
+        entry = self.sku(guid)
+        return entry['Product_Display_Name'] if entry else default
+
+    def name_skus(self, df, id_col='id'):
+        """Adds Product_Display_Name / String_Id to df by SKU GUID (vectorized, one-to-one)."""
+        keys = df[id_col].astype(str).str.lower()
+        out = df.copy()
+        out['Product_Display_Name'] = keys.map(self.skus['Product_Display_Name'])
+        out['String_Id'] = keys.map(self.skus['String_Id'])
+        return out
+
+
+def _split(df):
+    out = df.astype(object).where(df.notna(), None).to_dict('split')
+    out['index_name'] = df.index.name
+    return out
+
+
+def _frame(d):
+    #same dtype=str as the csv read in from_csv
+    df = pd.DataFrame(d['data'], columns=d['columns'], dtype=str)
+    if d.get('index_name'):
+        df.index = pd.Index(d['index'], name=d['index_name'], dtype=str)
+    return df
+
+
+def load_catalog(csv_path, cache_path=None):
+    """
+    Returns a LicenseCatalog, rebuilding the cached index only when the csv content changed.
+    """
+    if cache_path is None:
+        cache_path = os.path.splitext(csv_path)[0] + '.catalog.json'
+    digest = _file_digest(csv_path)
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('version') == CATALOG_VERSION and cached.get('digest') == digest:
+                return LicenseCatalog(_frame(cached['skus']), _frame(cached['plans']),
+                                      _frame(cached['sku_plans']), digest)
+        except Exception as e:
+            print(f"Catalog cache unreadable, rebuilding: {e}")
+    catalog = LicenseCatalog.from_csv(csv_path)
+    catalog.digest = digest
+    tmp = cache_path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'version': CATALOG_VERSION, 'digest': digest, 'skus': _split(catalog.skus),
+                   'plans': _split(catalog.plans), 'sku_plans': _split(catalog.sku_plans)}, f)
+    os.replace(tmp, cache_path)
+    print(f"License catalog rebuilt: {len(catalog.skus)} SKUs, {len(catalog.plans)} service plans")
+    return catalog
+
+
+# ---- Rollups ----
+
+def tenant_license_rows(subscribed, catalog):
+    """
+    The comp_365_licenses table: one row per subscribed SKU with its product name, prepaid and consumed units.
+    subscribed: json_normalize of /subscribedSkus.  Shared by get_licenses.py and the license change handler.
+    """
+    df2 = subscribed[['accountName', 'appliesTo', 'capabilityStatus', 'skuId', 'skuPartNumber', 'consumedUnits',
+                      'prepaidUnits.enabled', 'prepaidUnits.suspended', 'prepaidUnits.warning',
+                      'prepaidUnits.lockedOut']].rename(columns={'skuId': 'id'})
+    dfmerge = catalog.name_skus(df2, id_col='id')
+    comp_365 = dfmerge[['accountName', 'appliesTo', 'Product_Display_Name', 'id', 'prepaidUnits.enabled',
+                        'consumedUnits']].copy()
+    comp_365.columns = comp_365.columns.str.replace('.', '_')
+    comp_365.columns = comp_365.columns.str.lower().str.replace(' ', '')
+    comp_365['uid'] = range(1, len(comp_365) + 1)
+    return comp_365.reset_index(drop=True)
+
+
+def sku_utilization(subscribed, catalog, user_skus=None):
+    """
+    subscribed: json_normalize of /subscribedSkus (skuId, skuPartNumber, consumedUnits, prepaidUnits.*)
+    user_skus:  optional (user_id, sku_id) pairs from /users/{id}/licenseDetails, adds assigned_users
+    One row per SKU with consumed vs prepaid units.
+    """
+    out = subscribed[['skuId', 'skuPartNumber', 'consumedUnits', 'prepaidUnits.enabled']].copy()
+    out = out.rename(columns={'skuId': 'sku_id', 'prepaidUnits.enabled': 'prepaid_enabled',
+                              'consumedUnits': 'consumed_units'})
+    out['sku_id'] = out['sku_id'].str.lower()
+    out['Product_Display_Name'] = out['sku_id'].map(catalog.skus['Product_Display_Name'])
+    out['available_units'] = out['prepaid_enabled'] - out['consumed_units']
+    out['utilization'] = (out['consumed_units'] / out['prepaid_enabled'].where(out['prepaid_enabled'] > 0)).round(4)
+    if user_skus is not None:
+        assigned = (user_skus.assign(sku_id=user_skus['sku_id'].str.lower())
+                    .drop_duplicates(['user_id', 'sku_id'])
+                    .groupby('sku_id').size().rename('assigned_users'))
+        out = out.join(assigned, on='sku_id')
+        out['assigned_users'] = out['assigned_users'].fillna(0).astype('int64')
+    return out.sort_values('utilization', ascending=False).reset_index(drop=True)
+
+
+def plan_utilization(subscribed, catalog, user_skus):
+    """
+    Service-plan level rollup in one pass:
+      prepaid_units - sum of prepaid seats of every SKU that includes the plan
+      consumed_units - sum of consumed seats of those SKUs
+      users_with_plan - distinct users holding at least one SKU that includes the plan
+    """
+    subs = subscribed[['skuId', 'consumedUnits', 'prepaidUnits.enabled']].rename(
+        columns={'skuId': 'sku_id', 'consumedUnits': 'consumed_units', 'prepaidUnits.enabled': 'prepaid_units'})
+    subs = subs.assign(sku_id=subs['sku_id'].str.lower())
+    sku_plans = catalog.sku_plans[catalog.sku_plans['sku_id'].isin(subs['sku_id'])]
+
+    units = (sku_plans.merge(subs, on='sku_id', how='inner')
+             .groupby('plan_id')[['prepaid_units', 'consumed_units']].sum())
+
+    pairs = user_skus.assign(sku_id=user_skus['sku_id'].str.lower())[['user_id', 'sku_id']]
+    pairs = pairs.drop_duplicates()
+    users = (pairs.merge(sku_plans, on='sku_id', how='inner')
+             .drop_duplicates(['user_id', 'plan_id'])
+             .groupby('plan_id').size().rename('users_with_plan'))
+
+    out = units.join(users, how='left')
+    out['users_with_plan'] = out['users_with_plan'].fillna(0).astype('int64')
+    out = out.join(catalog.plans, how='left')
+    out['utilization'] = (out['users_with_plan'] / out['prepaid_units'].where(out['prepaid_units'] > 0)).round(4)
+    out.index.name = 'plan_id'
+    return out.reset_index().sort_values('users_with_plan', ascending=False).reset_index(drop=True)
+
+
+def user_license_matrix(user_skus):
+    """Replaces the get_dummies + groupby('upn').max() step: one row per user, one bool column per SKU."""
+    pairs = user_skus.drop_duplicates(['upn', 'skuPartNumber'])
+    return pd.crosstab(pairs['upn'], pairs['skuPartNumber']).astype(bool).reset_index()
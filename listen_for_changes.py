@@ -0,0 +1,122 @@
+#Near real-time updates instead of full polling scans
+#Subscribes to users, groups and the drive roots, receives Graph change notifications on a local port and
+#only re-reads what changed (comp_365_licenses, intune_devices, Site_Access_Matrix.xlsx, folder rollups).
+#Graph has to reach NOTIFICATION_URL over https, put a reverse proxy / tunnel in front of LISTEN_PORT.
+#Test locally without a tenant: change_notifications.send_test_notification(...)
+
+import os
+import threading
+import datetime
+import time
+from msal import ConfidentialClientApplication
+from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
+from dotenv import load_dotenv,find_dotenv
+from change_notifications import (SubscriptionManager, NotificationReceiver, ChangeProcessor,
+                                  make_license_handler, make_group_access_handler, make_drive_handler,
+                                  make_device_handler, load_drive_rollup, poll_device_changes)
+from excel_output import write_excel_streaming
+from license_catalog import load_catalog
+
+load_dotenv(find_dotenv("C:/Python_Scripts/N-Able/.env"))
+sql_pass=os.getenv('sqlpass')
+client_id=os.getenv('client_id')
+tenant_id =os.getenv('tenant_id')
+client_secret =os.getenv('client_secret')
+
+NOTIFICATION_URL = "https://your-public-host.example.com/notifications"
+LIFECYCLE_URL = "https://your-public-host.example.com/lifecycle"
+LISTEN_PORT = 8765
+DRIVE_IDS = []  # drives to watch, e.g. the dl list from Review_Sharepoint.py (none: no drive subscriptions)
+DEVICE_POLL_MINUTES = 15
+LICENSE_CATALOG_CSV = 'c:/users/public/Product names and service plan identifiers for licensing(2).csv'
+SITES_XLSX = r"C:\Python_Scripts\api_calls\reports\Sites_For_Permissioning.xlsx"
+ACCESS_MATRIX_XLSX = r"C:\Python_Scripts\api_calls\reports\Site_Access_Matrix.xlsx"
+ARCHIVE_XLSX = r"C:\Python_Scripts\api_calls\reports\Archive_Candidates.xlsx"
+ARCHIVE_CUTOFF = '2015-01-01'
+
+msal_app = ConfidentialClientApplication(
+    client_id=client_id,
+    client_credential=client_secret,
+    authority=f"https://login.microsoftonline.com/{tenant_id}",
+)
+headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+
+
+def refresh_token():
+    #handlers share this dict so refreshing it in place is enough
+    result = msal_app.acquire_token_silent(scopes=["https://graph.microsoft.com/.default"], account=None)
+    if not result:
+        result = msal_app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
+    if "access_token" not in result:
+        raise Exception("No Access Token found")
+    headers['Authorization'] = 'Bearer ' + result['access_token']
+
+
+refresh_token()
+
+connection_url = URL.create(
+    "mssql+pyodbc",
+    username="SQLUser",
+    password=sql_pass,
+    host="127.0.0.1",
+    port=1450,
+    database="calls",
+    query={
+        "driver": "ODBC Driver 17 for SQL Server",
+        "Encrypt": "yes",
+        "TrustServerCertificate": "yes",
+    },
+)
+engine = create_engine(connection_url)
+
+# Handlers reuse the batch scripts' transforms and targets: comp_365_licenses (get_licenses.py),
+# intune_devices (managed_devices.py) and Site_Access_Matrix.xlsx (getusersfromsites.py)
+catalog = load_catalog(LICENSE_CATALOG_CSV)
+handlers = {
+    'users': make_license_handler(engine, headers, catalog),
+    'groups': make_group_access_handler(headers, SITES_XLSX, ACCESS_MATRIX_XLSX),
+    'devices': make_device_handler(engine, headers),
+}
+resources = ['users', 'groups']
+
+# Folder rollups start from a full listing of the watched drives, then only deltas are applied
+# the processor thread applies deltas while the loop below reads archive candidates, hence the lock
+rollup, rollup_lock = None, threading.Lock()
+if DRIVE_IDS:
+    rollup, delta_links = load_drive_rollup(headers, DRIVE_IDS)
+    handlers['drive'] = make_drive_handler(headers, rollup, delta_links, lock=rollup_lock)
+    resources += [f'drives/{drive_id}/root' for drive_id in DRIVE_IDS]
+
+subs = SubscriptionManager(headers, NOTIFICATION_URL, lifecycle_url=LIFECYCLE_URL)
+receiver = NotificationReceiver(subs.client_state, subscription_ids=subs.subscription_ids,
+                                port=LISTEN_PORT,
+                                on_lifecycle=lambda n: subs.renew_by_id(n.get('subscriptionId'))).start()
+
+# Only resources with a handler are subscribed, leftovers from earlier runs are removed
+subs.retain(resources)
+for resource in resources:
+    subs.ensure(resource)
+
+stop = threading.Event()
+processor = ChangeProcessor(receiver.queue, handlers)
+threading.Thread(target=processor.run, args=(stop,), daemon=True).start()
+threading.Thread(target=subs.run_renewals, args=(stop,), daemon=True).start()
+
+last_sync = datetime.datetime.now(datetime.timezone.utc)
+try:
+    while True:
+        time.sleep(DEVICE_POLL_MINUTES * 60)
+        refresh_token()
+        try:
+            last_sync = poll_device_changes(headers, receiver.queue, last_sync, subs.client_state)
+        except RuntimeError as e:
+            print(f"  ❌ Device poll failed, retried from the same point next round: {e}")
+        if rollup is not None:
+            with rollup_lock:
+                candidates = rollup.archive_candidates(ARCHIVE_CUTOFF)
+            write_excel_streaming(candidates, ARCHIVE_XLSX)
+        print(f"{datetime.datetime.now():%X} processed so far: {dict(processor.processed)}")
+except KeyboardInterrupt:
+    stop.set()
+    receiver.stop()
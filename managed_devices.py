@@ -9,6 +9,15 @@ import pandas as pd
 from sqlalchemy import create_engine
 from sqlalchemy.engine import URL
 from dotenv import load_dotenv,find_dotenv
+from snapshot_store import SnapshotStore
+from guid_keys import GuidRegistry
+from stale_devices import (fetch_sign_in_activity, fetch_devices, classify_devices, write_flagged_delta,
+                           intune_device_rows)
+from graph_replay import enable_from_env
+from graph_models import ManagedDevice, iter_pages, to_frame
+
+# GRAPH_HTTP_MODE=record/replay serves Graph calls from an archive for offline profiling (see graph_replay.py)
+enable_from_env()
 
 #To point to specific secret directory
 load_dotenv(find_dotenv("C:/Python_Scripts/N-Able/.env"))
@@ -60,9 +69,7 @@ headers = {
 }
 
 
-# This url can be used to query recent sign ins to compare to device list
-# response = requests.get(url="https://graph.microsoft.com//beta/users?$select=userprincipalname,signInActivity",
-#     headers=headers)
+# Recent sign ins are compared to the device list in the stale device stage below (stale_devices.py)
 
 
 
@@ -76,61 +83,19 @@ http_headers = {'Authorization': 'Bearer ' + result['access_token'],
                 'Accept': 'application/json',
                 'Content-Type': 'application/json'}
 
-frames = []
-data = requests.get(endpoint, headers=http_headers, stream=False).json()
-eps = pd.json_normalize(data['value'])
+# every page, not just the first one
+eps = pd.concat([to_frame(page, ManagedDevice) for page in iter_pages(endpoint, http_headers, ManagedDevice)],
+                ignore_index=True)
 print(eps.shape)
 eps_cleaned= eps.dropna(axis=1, how='all')
 
 
-# Use to remove any test users from the list of managed devices
-#filtered = eps_cleaned[~eps_cleaned['userPrincipalName'].isin(['test@testcompanies.com'])]
-
-filtered.replace('', pd.NA, inplace=True)
-filtered = filtered.dropna(subset=['userPrincipalName'])
-# Drop columns with all NaN values
-filtered= filtered.dropna(axis=1, how='all')
-filtered['last_sync_date'] = pd.to_datetime(filtered['lastSyncDateTime'],errors='coerce').dt.date
-filtered = filtered[['id', 'userId','last_sync_date', 'deviceName', 'managedDeviceOwnerType',
-       'enrolledDateTime', 'lastSyncDateTime', 'operatingSystem','complianceState',  'osVersion',
-       'easActivated', 'easDeviceId', 'easActivationDateTime',
-       'azureADRegistered', 'deviceEnrollmentType', 'emailAddress','azureADDeviceId', 
-       'deviceCategoryDisplayName', 'isSupervised','isEncrypted', 'userPrincipalName','model', 'manufacturer', 
-       'complianceGracePeriodExpirationDateTime', 'serialNumber','userDisplayName','wiFiMacAddress', 
-       'totalStorageSpaceInBytes', 'freeStorageSpaceInBytes',
-       'managedDeviceName', 'partnerReportedThreatState',
-        'managementCertificateExpirationDate',
-       'physicalMemoryInBytes', 'deviceActionResults']]
-
-print(filtered.shape)
-filtered['osVersion'].value_counts()
-
-
-#translate os versions to build names
-#Windows 10.0.22 or higher is Windows 11, below 10.
-#Mac so many versions...
-def identify_os_version(os_version):
-    if os_version.startswith("10.0.22") or os_version.startswith("10.0.23") or os_version.startswith("10.0.24")or os_version.startswith("10.0.25")or os_version.startswith("10.0.26")or os_version.startswith("10.0.27"):
-        return "Windows 11"
-    elif os_version.startswith("10.0"):
-        return "Windows 10"
-    elif os_version.startswith("13"):
-        return f"macOS Ventura {os_version}"
-    elif os_version.startswith("14"):
-        return f"macOS Big Sur {os_version}"
-    elif os_version.startswith("15"):
-        return f"macOS Monterey {os_version}"
-    else:
-        return f"Unknown {os_version}"
-
-
-# Apply the identification function to the osVersion column
-filtered['osVersionName'] = filtered['osVersion'].apply(identify_os_version)
-os_versions = filtered[['id', 'userId','last_sync_date', 'deviceName', 'managedDeviceOwnerType',
-  'complianceState',  'osVersionName','osVersion','operatingSystem',
-   'azureADRegistered', 'deviceEnrollmentType', 'emailAddress','azureADDeviceId', 
-   'deviceCategoryDisplayName', 'isSupervised','isEncrypted', 'userPrincipalName','model', 'manufacturer', 
- 'serialNumber','userDisplayName','wiFiMacAddress']]
+# intune_devices rows: devices without a user dropped, last_sync_date and osVersionName (Windows 10/11, macOS names)
+# added. Same transform the device change handler uses (listen_for_changes.py)
+# Use exclude_upns to remove any test users from the list of managed devices
+os_versions = intune_device_rows(eps_cleaned)  # , exclude_upns=['test@testcompanies.com']
+print(os_versions.shape)
+os_versions['osVersion'].value_counts()
 #os_versions = os_versions[~os_versions['model'].str.contains('Microsoft Dev Box')]
 
 #localsql connection
@@ -152,6 +117,25 @@ engine = create_engine(connection_url)
 
 #Update SQL Table
 os_versions.to_sql('intune_devices', engine, if_exists='replace', index=False)
+
+#Keep a dated copy since the SQL table is replaced every run
+store = SnapshotStore(r"C:\Python_Scripts\api_calls\snapshots")
+store.write('intune_devices', os_versions, key='id')
+#e.g. devices that fell out of compliance this week:
+# days = store.snapshots('intune_devices')
+# changed = store.diff('intune_devices', days[-7] if len(days) >= 7 else days[0], days[-1], key='id')['changed']
+# changed[changed['complianceState'] == 'noncompliant']
+
+#Stale devices: all devices (paged) joined to every user's signInActivity on userId
+#flags stale sync / inactive user / disabled or deleted user / noncompliant past grace
+#only devices whose flag changed since the last run are written
+#GUIDs are interned to int32 codes so the join hashes ints, they are turned back into ids on write
+guids = GuidRegistry()
+users_activity = fetch_sign_in_activity(http_headers, registry=guids)
+all_devices = fetch_devices(http_headers, registry=guids)
+stale = classify_devices(all_devices, users_activity, sync_days=30, sign_in_days=30, compliance_days=14)
+print(stale['stale_status'].value_counts())
+write_flagged_delta(stale, engine, table='intune_stale_devices', registry=guids)
 myQuery3 = '''
             SELECT *
             FROM intune_devices
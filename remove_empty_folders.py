@@ -3,6 +3,8 @@ import os
 from datetime import datetime
 import time
 import requests
+from excel_output import write_excel_streaming, read_table
+from scan_scheduler import plan_library_scans, scan_libraries, SqliteWorkQueue, run_queue_worker
 
 # ================= CONFIGURATION =================
 # 1. REVIEW MODE: Set to False first. It will only generate an Excel list.
@@ -11,25 +13,18 @@ DELETE_MODE = False
 
 # Protection: Never delete folders at the root of the library (Depth 0)
 SKIP_TOP_LEVEL = False
+
+# Libraries are scanned largest-first in parallel. Set SCAN_QUEUE to a .db path on a share to split
+# the scan across machines (run this cell on each one: the first starts a new scan run and fills the
+# queue, the others join it; every machine waits until the whole run is finished before writing).
+SCAN_WORKERS = 8
+SCAN_QUEUE = None
 # =================================================
 
 stats_xlsx = os.path.join(reports_dir, "Library_Statistics_Latest.xlsx")
 review_xlsx = os.path.join(reports_dir, "Empty_Folders_For_Review.xlsx")
 
 # --- Helper Functions ---
-def safe_graph_get(url):
-    resp = graph_get(url) # Uses your existing graph_get function
-    api_call_counter[0] += 1
-    if api_call_counter[0] % 100 == 0: # Optimized: Pausing less frequently
-        print(f"  ⏸️  Pausing after {api_call_counter[0]} API calls...")
-        time.sleep(1)
-    if getattr(resp, 'status_code', None) == 429:
-        retry_after = int(resp.headers.get('Retry-After', 10))
-        print(f"  ⚠️ Throttled! Waiting {retry_after}s...")
-        time.sleep(retry_after)
-        return safe_graph_get(url)
-    return resp
-
 def safe_delete(url, headers):
     resp = requests.delete(url, headers=headers)
     api_call_counter[0] += 1
@@ -39,46 +34,6 @@ def safe_delete(url, headers):
         return safe_delete(url, headers)
     return resp
 
-def list_empty_folders_fast(drive_id, item_id="root", depth=0, empty_folders=None):
-    """
-    Optimized recursive function. 
-    Checks 'childCount' immediately to avoid extra API calls.
-    """
-    if empty_folders is None:
-        empty_folders = []
-    
-    url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/items/{item_id}/children?$select=id,name,folder,parentReference&$top=5000"
-    resp = safe_graph_get(url)
-    
-    if getattr(resp, 'status_code', None) != 200:
-        return empty_folders
-        
-    items = resp.json().get('value', [])
-    
-    for item in items:
-        # We only care about folders
-        if 'folder' in item:
-            child_count = item['folder'].get('childCount', 0)
-            
-            # OPTIMIZATION: Check childCount directly
-            if child_count == 0:
-                # Found an empty folder!
-                if SKIP_TOP_LEVEL and depth == 0:
-                    continue # Skip if it is a root folder
-                
-                empty_folders.append({
-                    'id': item['id'],
-                    'name': item['name'],
-                    'depth': depth,
-                    'drive_id': drive_id, # Store for deletion later
-                    'parent_id': item.get('parentReference', {}).get('id', '')
-                })
-            else:
-                # If not empty, dive deeper
-                list_empty_folders_fast(drive_id, item['id'], depth+1, empty_folders)
-                
-    return empty_folders
-
 # ================= MAIN LOGIC =================
 if not os.path.exists(stats_xlsx):
     print(f"Stats file not found: {stats_xlsx}")
@@ -88,41 +43,46 @@ else:
     if not DELETE_MODE:
         # --- SCANNING PHASE (FAST) ---
         print("\n🚀 FAST SCAN MODE: Identifying empty folders...")
-        stats_df = pd.read_excel(stats_xlsx, sheet_name="All_Libraries")
-        all_empty_folders = []
-
-        for idx, row in stats_df.iterrows():
-            site_name = row['site_name']
-            library_name = row['library_name']
-            
-            print(f"Scanning {idx+1}/{len(stats_df)}: {library_name}")
-
-            # Get Drive ID
-            drive_id = None
-            if row.get('site_id') and row.get('library_id'):
-                drive_resp = safe_graph_get(f"https://graph.microsoft.com/v1.0/sites/{row['site_id']}/lists/{row['library_id']}/drive")
-                if getattr(drive_resp, 'status_code', None) == 200:
-                    drive_id = drive_resp.json().get('id')
-
-            if drive_id:
-                # Use the FAST function
-                found = list_empty_folders_fast(drive_id)
-                if found:
-                    for f in found:
-                        f['site_name'] = site_name
-                        f['library_name'] = library_name
-                    all_empty_folders.extend(found)
-                    print(f"  Found {len(found)} empty folders.")
+        stats_df = read_table(stats_xlsx, sheet_name="All_Libraries")
+        # Largest libraries first (counts from the stats sheet), drive ids resolved through $batch
+        # get_auth_headers is passed itself (not its result) so long scans pick up a fresh token
+        if SCAN_QUEUE:
+            queue = SqliteWorkQueue(SCAN_QUEUE)
+            # Joins the scan another machine is running, otherwise starts a new one
+            run_id, started = queue.join_or_start()
+            if started:
+                try:
+                    queue.enqueue(run_id, plan_library_scans(stats_df, get_auth_headers))
+                except Exception:
+                    queue.abandon(run_id)
+                    raise
+            print(f"Scan run {run_id} ({'started' if started else 'joined'})")
+            run_queue_worker(SCAN_QUEUE, run_id, get_auth_headers, skip_top_level=SKIP_TOP_LEVEL)
+            # Libraries still running on other machines must be in the review file too
+            print(f"Queue status: {queue.wait_for_run(run_id)}")
+            for library_name, error in queue.failed(run_id):
+                print(f"  ⚠️ Not scanned: {library_name}: {error}")
+            all_empty_folders = queue.results(run_id)
+        else:
+            tasks = plan_library_scans(stats_df, get_auth_headers)
+            print(f"Scanning {len(tasks)} libraries with {SCAN_WORKERS} workers...")
+            all_empty_folders = scan_libraries(tasks, get_auth_headers, workers=SCAN_WORKERS,
+                                               skip_top_level=SKIP_TOP_LEVEL)
 
         # Save to Excel for Review
         if all_empty_folders:
             results_df = pd.DataFrame(all_empty_folders)
             # Sort by depth descending (deepest first) just in case
             results_df = results_df.sort_values('depth', ascending=False)
-            results_df.to_excel(review_xlsx, index=False)
+            # Streams to xlsx + writes a parquet sidecar the delete phase reads back
+            write_excel_streaming(results_df, review_xlsx, sheet_name="Empty_Folders")
             print(f"\n✅ Scan Complete. Review file created: {review_xlsx}")
             display(results_df.head())
         else:
+            # Overwrite the previous review file so DELETE_MODE can't act on an older scan
+            write_excel_streaming(pd.DataFrame(columns=['id', 'name', 'depth', 'drive_id', 'parent_id',
+                                                        'site_name', 'library_name']),
+                                  review_xlsx, sheet_name="Empty_Folders")
             print("\n✅ Scan Complete. No empty folders found.")
 
     else:
@@ -133,7 +93,8 @@ else:
             print(f"❌ Review file not found: {review_xlsx}")
             print("Run with DELETE_MODE = False first.")
         else:
-            df_to_delete = pd.read_excel(review_xlsx)
+            # Sidecar is skipped if the review xlsx was edited after the scan
+            df_to_delete = read_table(review_xlsx)
             print(f"Loaded {len(df_to_delete)} folders to delete.")
             
             deleted_count = 0
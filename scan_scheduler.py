@@ -0,0 +1,395 @@
+#Largest-first scheduling for the empty folder scan across document libraries
+#Uses the item counts / sizes already in Library_Statistics_Latest.xlsx to order libraries biggest first
+#(longest-processing-time first), resolves all drive ids through Graph $batch (20 per request) and
+#runs the scans on a local process pool, or hands them out to several machines through a shared
+#SQLite queue file.  Wall time ends up close to the largest library instead of the sum of all of them.
+
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import requests
+
+from graph_models import DriveItem, decode_page
+
+GRAPH = "https://graph.microsoft.com/v1.0"
+BATCH_SIZE = 20  # Graph $batch limit
+
+# First match wins, most to least useful for predicting scan time (one API call per folder)
+WEIGHT_COLUMNS = ['folder_count', 'total_folders', 'item_count', 'total_items', 'file_count',
+                  'total_files', 'size_bytes', 'total_size', 'size_gb', 'storage_used']
+
+
+class ScanError(Exception):
+    """A library scan hit a Graph error, its partial results are not used."""
+
+
+def _headers(headers):
+    #headers may be a dict or a callable returning a fresh one (e.g. get_auth_headers)
+    return headers() if callable(headers) else headers
+
+
+def _get(url, headers, state):
+    """
+    GET with 429/503 waits.  state['headers'] holds the headers in use, on a 401 they are
+    refreshed once from the callable (tokens expire during long scans).
+    """
+    refreshed = False
+    while True:
+        resp = requests.get(url, headers=state['headers'])
+        if resp.status_code in (429, 503):
+            time.sleep(int(resp.headers.get('Retry-After', 10)))
+            continue
+        if resp.status_code == 401 and callable(headers) and not refreshed:
+            state['headers'] = headers()
+            refreshed = True
+            continue
+        return resp
+
+
+def order_libraries(stats_df, weight_col=None):
+    """Returns stats_df sorted largest-first with a scan_weight column."""
+    if weight_col is None:
+        weight_col = next((c for c in WEIGHT_COLUMNS if c in stats_df.columns), None)
+    out = stats_df.copy()
+    if weight_col is None:
+        print("No item count / size column found, keeping file order")
+        out['scan_weight'] = 0
+        return out
+    out['scan_weight'] = pd.to_numeric(out[weight_col], errors='coerce').fillna(0)
+    return out.sort_values('scan_weight', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def resolve_drive_ids(stats_df, headers):
+    """
+    One $batch call per 20 libraries instead of one GET each.
+    Returns a list of drive ids aligned with stats_df rows (None where it could not be resolved, each
+    of those is reported).  Raises ScanError when a whole batch fails.
+    """
+    drive_ids = [None] * len(stats_df)
+    records = stats_df.to_dict('records')
+    pending = [(i, row['site_id'], row['library_id']) for i, row in enumerate(records)
+               if row.get('site_id') and row.get('library_id')
+               and not pd.isna(row.get('site_id')) and not pd.isna(row.get('library_id'))]
+    batch_headers = dict(_headers(headers), **{'Content-Type': 'application/json'})
+    refreshed = False
+    failed = []
+    while pending:
+        retry, wait = [], 0
+        for start in range(0, len(pending), BATCH_SIZE):
+            chunk = pending[start:start + BATCH_SIZE]
+            body = {'requests': [{'id': str(i), 'method': 'GET',
+                                  'url': f"/sites/{site_id}/lists/{library_id}/drive?$select=id"}
+                                 for i, site_id, library_id in chunk]}
+            resp = requests.post(f"{GRAPH}/$batch", headers=batch_headers, data=json.dumps(body))
+            if resp.status_code in (429, 503, 504):
+                retry.extend(chunk)
+                wait = max(wait, int(resp.headers.get('Retry-After', 10)))
+                continue
+            if resp.status_code == 401 and callable(headers) and not refreshed:
+                # token expired, same as _get: refresh once and send this chunk again
+                batch_headers = dict(headers(), **{'Content-Type': 'application/json'})
+                refreshed = True
+                retry.extend(chunk)
+                continue
+            if resp.status_code != 200:
+                raise ScanError(f"$batch resolving drives: HTTP {resp.status_code} {resp.text[:200]}")
+            by_id = {int(i): (s, l) for i, s, l in chunk}
+            for r in resp.json().get('responses', []):
+                i = int(r['id'])
+                status = r.get('status')
+                if status == 200:
+                    drive_ids[i] = r.get('body', {}).get('id')
+                elif status in (429, 503, 504):
+                    retry.append((i,) + by_id[i])
+                    wait = max(wait, int((r.get('headers') or {}).get('Retry-After', 10)))
+                else:
+                    error = (r.get('body') or {}).get('error') or {}
+                    failed.append(i)
+                    print(f"  ⚠️ No drive for {records[i].get('site_name')} / {records[i].get('library_name')}: "
+                          f"HTTP {status} {error.get('code', '')}")
+        if retry:
+            print(f"  Retrying {len(retry)} drive lookups in {wait}s...")
+            time.sleep(wait)
+        pending = retry
+    if failed:
+        print(f"  ⚠️ {len(failed)} libraries could not be resolved and will not be scanned")
+    return drive_ids
+
+
+def plan_library_scans(stats_df, headers, weight_col=None):
+    """Ordered list of scan tasks (dicts) for every library whose drive could be resolved."""
+    ordered = order_libraries(stats_df, weight_col)
+    ordered['drive_id'] = resolve_drive_ids(ordered, headers)
+    missing = ordered['drive_id'].isna().sum()
+    if missing:
+        print(f"  {missing} libraries without a drive, skipped")
+    ordered = ordered[ordered['drive_id'].notna()]
+    return [{'drive_id': r['drive_id'], 'site_name': r.get('site_name'), 'library_name': r.get('library_name'),
+             'scan_weight': float(r['scan_weight'])} for r in ordered.to_dict('records')]
+
+
+def find_empty_folders(drive_id, headers, skip_top_level=False):
+    """
+    Same walk as list_empty_folders_fast (childCount == 0 is empty, otherwise descend) but iterative
+    and following @odata.nextLink so folders with more children than one page are covered.
+    headers can be a callable, it is called at the start and again whenever the token has expired.
+    Raises ScanError on any other non-200 instead of returning a partial list.
+    """
+    state = {'headers': _headers(headers)}
+    empty_folders = []
+    stack = [('root', 0)]
+    while stack:
+        item_id, depth = stack.pop()
+        url = f"{GRAPH}/drives/{drive_id}/items/{item_id}/children?$select=id,name,folder,parentReference&$top=999"
+        while url:
+            resp = _get(url, headers, state)
+            if resp.status_code != 200:
+                raise ScanError(f"drive {drive_id} item {item_id}: HTTP {resp.status_code} {resp.text[:200]}")
+            items, url, _ = decode_page(resp.content, DriveItem)
+            for item in items:
+                if item.folder is None:
+                    continue
+                if item.folder.childCount == 0:
+                    if skip_top_level and depth == 0:
+                        continue
+                    empty_folders.append({
+                        'id': item.id,
+                        'name': item.name,
+                        'depth': depth,
+                        'drive_id': drive_id,
+                        'parent_id': item.parentReference.id if item.parentReference else '',
+                    })
+                else:
+                    stack.append((item.id, depth + 1))
+    return empty_folders
+
+
+def scan_library(task, headers, skip_top_level=False):
+    found = find_empty_folders(task['drive_id'], headers, skip_top_level)
+    for f in found:
+        f['site_name'] = task.get('site_name')
+        f['library_name'] = task.get('library_name')
+    return found
+
+
+def scan_libraries(tasks, headers, workers=8, skip_top_level=False, executor='process'):
+    """
+    Runs scan_library over tasks on a local pool.  Tasks are submitted in the given (largest-first)
+    order so the big libraries start immediately and the small ones fill in around them.
+    executor='thread' avoids process start-up cost (the scan is mostly waiting on Graph).
+    headers can be a callable (get_auth_headers): threads refresh through it on a 401, processes get
+    fresh headers per task since only workers tasks are in flight at a time, and a task that still
+    ends on an expired token is retried once.  Returns the empty folders of the libraries that
+    scanned cleanly; failed libraries are listed and left out.
+    """
+    pool_cls = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+    results, failed = [], []
+    pending = [(t, 0) for t in reversed(tasks)]  # popped from the end, largest first
+
+    def task_headers():
+        #a notebook function can't be pickled into a worker process, hand it a dict instead
+        return _headers(headers) if pool_cls is ProcessPoolExecutor else headers
+
+    with pool_cls(max_workers=workers) as pool:
+        futures = {}
+        n = 0
+        while pending or futures:
+            while pending and len(futures) < workers:
+                task, attempt = pending.pop()
+                futures[pool.submit(scan_library, task, task_headers(), skip_top_level)] = (task, attempt)
+            done = next(as_completed(futures))
+            task, attempt = futures.pop(done)
+            try:
+                found = done.result()
+            except ScanError as e:
+                if 'HTTP 401' in str(e) and callable(headers) and attempt == 0:
+                    print(f"  Token expired scanning {task.get('library_name')}, retrying")
+                    pending.append((task, 1))
+                    continue
+                failed.append(task)
+                print(f"  ❌ {task.get('library_name')}: {e}")
+                continue
+            except Exception as e:
+                failed.append(task)
+                print(f"  ❌ {task.get('library_name')}: {e}")
+                continue
+            n += 1
+            results.extend(found)
+            print(f"Scanned {n}/{len(tasks)}: {task.get('library_name')} ({len(found)} empty folders)")
+    if failed:
+        print(f"⚠️ {len(failed)} libraries failed and are not in the results: "
+              f"{', '.join(str(t.get('library_name')) for t in failed)}")
+    return results
+
+
+class SqliteWorkQueue:
+    """
+    File-backed queue so several machines can share one scan: put the .db on a share everyone can
+    write, then run the scan on each machine.  Every scan is a run with its own id; the first machine
+    starts it (join_or_start) and plans the tasks, the others join the same run until it is finished,
+    so a reused queue file never hands back an earlier run's folders.  Claims are atomic
+    (BEGIN IMMEDIATE) and are handed out by priority, so the largest libraries are always taken first.
+    """
+
+    PLANNING_TIMEOUT = 3600  # a run stuck in planning this long (planner died) no longer blocks new runs
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY, priority REAL, payload TEXT, status TEXT DEFAULT 'pending',
+            worker TEXT, claimed_at REAL, result TEXT, error TEXT)""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS runs (
+            run_id TEXT PRIMARY KEY, status TEXT, created REAL, started_by TEXT)""")
+        columns = [r[1] for r in self.conn.execute("PRAGMA table_info(tasks)")]
+        if 'run_id' not in columns:
+            # queue files from before runs existed, their rows are never picked up again
+            self.conn.execute("ALTER TABLE tasks ADD COLUMN run_id TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_tasks_run ON tasks(run_id, status, priority)")
+
+    def _active_run(self):
+        row = self.conn.execute("SELECT run_id FROM runs ORDER BY created DESC LIMIT 1").fetchone()
+        if row is None:
+            return None
+        run_id = row[0]
+        status = self.run_status(run_id)
+        if status == 'planning':
+            return run_id
+        if status == 'ready' and self.conn.execute(
+                "SELECT 1 FROM tasks WHERE run_id = ? AND status IN ('pending', 'running') LIMIT 1",
+                (run_id,)).fetchone():
+            return run_id
+        return None
+
+    def join_or_start(self, worker=None):
+        """
+        Returns (run_id, started).  Joins the latest run while it still has work (or is being planned),
+        otherwise starts a new one in 'planning' state: the caller must then enqueue() its tasks
+        (or abandon() the run if planning fails).
+        """
+        worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            run_id = self._active_run()
+            if run_id is not None:
+                self.conn.execute("COMMIT")
+                return run_id, False
+            run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+            self.conn.execute("INSERT INTO runs(run_id, status, created, started_by) VALUES (?, 'planning', ?, ?)",
+                              (run_id, time.time(), worker))
+            self.conn.execute("COMMIT")
+            return run_id, True
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def enqueue(self, run_id, tasks):
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.executemany("INSERT INTO tasks(run_id, priority, payload) VALUES (?, ?, ?)",
+                              [(run_id, t.get('scan_weight', 0), json.dumps(t)) for t in tasks])
+        self.conn.execute("UPDATE runs SET status = 'ready' WHERE run_id = ?", (run_id,))
+        self.conn.execute("COMMIT")
+
+    def abandon(self, run_id):
+        self.conn.execute("UPDATE runs SET status = 'abandoned' WHERE run_id = ?", (run_id,))
+
+    def run_status(self, run_id):
+        """'planning', 'ready' or 'abandoned' (also for a planner that died without saying so)."""
+        row = self.conn.execute("SELECT status, created FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        if row[0] == 'planning' and time.time() - row[1] >= self.PLANNING_TIMEOUT:
+            return 'abandoned'
+        return row[0]
+
+    def claim(self, run_id, worker):
+        self.conn.execute("BEGIN IMMEDIATE")
+        row = self.conn.execute("SELECT id, payload FROM tasks WHERE run_id = ? AND status = 'pending' "
+                                "ORDER BY priority DESC, id LIMIT 1", (run_id,)).fetchone()
+        if row is None:
+            self.conn.execute("COMMIT")
+            return None, None
+        self.conn.execute("UPDATE tasks SET status = 'running', worker = ?, claimed_at = ? WHERE id = ?",
+                          (worker, time.time(), row[0]))
+        self.conn.execute("COMMIT")
+        return row[0], json.loads(row[1])
+
+    def complete(self, task_id, result):
+        self.conn.execute("UPDATE tasks SET status = 'done', result = ? WHERE id = ?", (json.dumps(result), task_id))
+
+    def fail(self, task_id, error):
+        self.conn.execute("UPDATE tasks SET status = 'failed', error = ? WHERE id = ?", (str(error), task_id))
+
+    def requeue_stale(self, run_id, older_than=4 * 3600):
+        """Puts back tasks claimed by a worker that died (claimed longer than older_than seconds ago)."""
+        cur = self.conn.execute("UPDATE tasks SET status = 'pending', worker = NULL WHERE run_id = ? "
+                                "AND status = 'running' AND claimed_at < ?", (run_id, time.time() - older_than))
+        return cur.rowcount
+
+    def counts(self, run_id):
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM tasks WHERE run_id = ? GROUP BY status",
+                                      (run_id,)).fetchall())
+
+    def is_finished(self, run_id):
+        if self.run_status(run_id) != 'ready':
+            return False
+        counts = self.counts(run_id)
+        return not counts.get('pending') and not counts.get('running')
+
+    def wait_for_run(self, run_id, poll=30, stale_after=4 * 3600):
+        """Blocks until no task of the run is pending or running, requeueing tasks of dead workers."""
+        while not self.is_finished(run_id):
+            if self.run_status(run_id) == 'abandoned':
+                raise RuntimeError(f"Run {run_id} was abandoned while planning")
+            if self.requeue_stale(run_id, stale_after):
+                print("  Requeued libraries from a worker that stopped responding")
+            print(f"  Waiting for other workers: {self.counts(run_id)}")
+            time.sleep(poll)
+        return self.counts(run_id)
+
+    def results(self, run_id):
+        """Empty folders of a finished run only, a partial list must never reach the delete step."""
+        if not self.is_finished(run_id):
+            raise RuntimeError(f"Run {run_id} still has pending or running libraries: {self.counts(run_id)}")
+        rows = self.conn.execute("SELECT result FROM tasks WHERE run_id = ? AND status = 'done'",
+                                 (run_id,)).fetchall()
+        return [f for (r,) in rows for f in json.loads(r)]
+
+    def failed(self, run_id):
+        rows = self.conn.execute("SELECT payload, error FROM tasks WHERE run_id = ? AND status = 'failed'",
+                                 (run_id,)).fetchall()
+        return [(json.loads(p).get('library_name'), e) for p, e in rows]
+
+
+def run_queue_worker(queue_path, run_id, headers, skip_top_level=False, worker=None, poll=30):
+    """
+    Claims and scans libraries of run_id from the shared queue until none are left.
+    headers can be a callable (get_auth_headers), it is called per library and on expired tokens.
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    queue = SqliteWorkQueue(queue_path)
+    done = 0
+    while True:
+        task_id, task = queue.claim(run_id, worker)
+        if task_id is None:
+            if queue.run_status(run_id) == 'planning':
+                # another machine is still resolving drives for this run
+                time.sleep(poll)
+                continue
+            if queue.requeue_stale(run_id):
+                continue
+            break
+        try:
+            queue.complete(task_id, scan_library(task, headers, skip_top_level))
+            done += 1
+            print(f"{worker} scanned {task.get('library_name')}")
+        except Exception as e:
+            queue.fail(task_id, e)
+            print(f"  ❌ {task.get('library_name')}: {e}")
+    return done
@@ -0,0 +1,69 @@
+#Owners / members of the M365 groups behind the sites in Sites_For_Permissioning.xlsx and the
+#Site_Access_Matrix built from them (one row per user, one column per site: Owner / Member / Visitor).
+#The long form (one row per group, user, role) is saved next to the matrix as <matrix>_Long.xlsx so
+#single groups can be refreshed (listen_for_changes.py) without re-reading every site.
+
+import os
+import pandas as pd
+
+from excel_output import write_excel_streaming, read_table
+from graph_models import User, decode_page
+
+GRAPH = "https://graph.microsoft.com/v1.0"
+ACCESS_COLUMNS = ['group_id', 'site_name', 'user_email', 'user_displayName', 'user_id', 'role']
+
+
+def fetch_group_access(group_id, site_name, get):
+    """
+    Owner and Member rows for one group, following @odata.nextLink.
+    get: callable url -> response (graph_get in the notebook).  Raises RuntimeError on a failed call
+    so a group is never written with half its users.
+    """
+    rows = []
+    for role, part in (('Owner', 'owners'), ('Member', 'members')):
+        url = f"{GRAPH}/groups/{group_id}/{part}?$select=id,displayName,mail,userPrincipalName"
+        while url:
+            resp = get(url)
+            if getattr(resp, 'status_code', None) != 200:
+                raise RuntimeError(f"Failed to get {part} of {site_name} "
+                                   f"(Status: {getattr(resp, 'status_code', 'N/A')})")
+            users, url, _ = decode_page(resp.content, User)
+            for u in users:
+                rows.append({'group_id': group_id, 'site_name': site_name, 'user_email': u.email,
+                             'user_displayName': u.displayName, 'user_id': u.id, 'role': role})
+    return rows
+
+
+def access_matrix(long_df):
+    """Owner beats Member for the same user and site, everyone not listed on a site is a Visitor."""
+    long_df = long_df.copy()
+    long_df['role_rank'] = long_df['role'].map({'Owner': 1, 'Member': 2})
+    long_df = long_df.sort_values('role_rank').drop_duplicates(subset=['user_email', 'site_name'], keep='first')
+    return long_df.pivot_table(
+        index=['user_displayName', 'user_email', 'user_id'],
+        columns='site_name',
+        values='role',
+        aggfunc='first',
+        fill_value='Visitor'
+    ).reset_index()
+
+
+def long_path(matrix_path):
+    stem, ext = os.path.splitext(matrix_path)
+    return f"{stem}_Long{ext}"
+
+
+def save_access_matrix(long_df, matrix_path):
+    """Writes the long form and the matrix built from it, returns the matrix."""
+    long_df = long_df.reindex(columns=ACCESS_COLUMNS)
+    write_excel_streaming(long_df, long_path(matrix_path), sheet_name='Access')
+    pivot_df = access_matrix(long_df)
+    write_excel_streaming(pivot_df, matrix_path)
+    return pivot_df
+
+
+def load_access_long(matrix_path):
+    path = long_path(matrix_path)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=ACCESS_COLUMNS)
+    return read_table(path, sheet_name='Access').reindex(columns=ACCESS_COLUMNS)
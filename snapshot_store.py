@@ -0,0 +1,173 @@
+#Daily snapshots of the tables that get replaced in SQL on every run (comp_365_licenses, intune_devices ...)
+#Layout: <root>/<dataset>/snapshot_date=YYYY-MM-DD/part-0.parquet  (zstd, hive style partitions)
+#Every row carries a 64-bit fingerprint of its non-key columns so diffs only read key + fingerprint.
+#Requires: pip install pyarrow
+
+import os
+import datetime
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+HASH_COL = '_row_hash'
+PARTITION = 'snapshot_date'
+
+
+def _as_date(value):
+    if value is None:
+        return datetime.date.today()
+    return pd.Timestamp(value).date()
+
+
+def _scalarize(df):
+    #lists/dicts from json_normalize can't be hashed or written as one parquet type
+    out = df.copy()
+    for col in out.columns[out.dtypes == object]:
+        out[col] = out[col].map(lambda v: str(v) if isinstance(v, (list, dict, tuple, set)) else v)
+    return out
+
+
+def _canonical(value):
+    #one text form per value whatever dtype the column landed in: a single null turns a bool
+    #column into object and an int column into float, which would otherwise change every hash
+    if isinstance(value, (list, dict, tuple, set)):
+        return str(value)
+    if pd.isna(value):
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return 'True' if value else 'False'
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+    if isinstance(value, (datetime.date, np.datetime64)):
+        return pd.Timestamp(value).isoformat()
+    return str(value)
+
+
+def row_fingerprints(df, key):
+    """
+    Sum over the non-null columns of hash(column name, canonical value).  Nulls add nothing, so a
+    new column only changes the rows that actually have a value in it.
+    """
+    keys = [key] if isinstance(key, str) else list(key)
+    total = np.zeros(len(df), dtype=np.uint64)
+    for col in df.columns:
+        if col in keys or col == HASH_COL:
+            continue
+        text = df[col].map(_canonical).to_numpy(dtype=object)
+        present = pd.notna(text)
+        if not present.any():
+            continue
+        tagged = np.array([f"{col}\x1f{v}" for v in text[present]], dtype=object)
+        total[present] += pd.util.hash_array(tagged)
+    return total
+
+
+class SnapshotStore:
+
+    def __init__(self, root):
+        self.root = root
+
+    def _dataset_dir(self, dataset):
+        return os.path.join(self.root, dataset)
+
+    def _partition_dir(self, dataset, date):
+        return os.path.join(self._dataset_dir(dataset), f"{PARTITION}={_as_date(date).isoformat()}")
+
+    def write(self, dataset, df, key, date=None):
+        """Writes (or replaces) the snapshot of dataset for date (default today)."""
+        keys = [key] if isinstance(key, str) else list(key)
+        out = _scalarize(df).reset_index(drop=True)
+        if out.duplicated(subset=keys).any():
+            raise ValueError(f"{dataset}: key {keys} is not unique")
+        out[HASH_COL] = row_fingerprints(out, keys)
+        part_dir = self._partition_dir(dataset, date)
+        os.makedirs(part_dir, exist_ok=True)
+        table = pa.Table.from_pandas(out, preserve_index=False)
+        # '_' prefix: pyarrow datasets skip it, so a crash mid-write never shows up in query()
+        tmp_path = os.path.join(part_dir, '_part-0.parquet.tmp')
+        pq.write_table(table, tmp_path, compression='zstd')
+        os.replace(tmp_path, os.path.join(part_dir, 'part-0.parquet'))
+        print(f"Snapshot {dataset} {_as_date(date)}: {len(out)} rows")
+        return part_dir
+
+    def snapshots(self, dataset):
+        base = self._dataset_dir(dataset)
+        if not os.path.isdir(base):
+            return []
+        return sorted(datetime.date.fromisoformat(d.split('=', 1)[1])
+                      for d in os.listdir(base) if d.startswith(f"{PARTITION}="))
+
+    def read(self, dataset, date, columns=None, filters=None):
+        path = os.path.join(self._partition_dir(dataset, date), 'part-0.parquet')
+        return pq.read_table(path, columns=columns, filters=filters).to_pandas()
+
+    def _schema(self, dataset):
+        """
+        Union of every snapshot's columns.  pyarrow otherwise takes the schema of the first file and
+        drops columns added later; nulls / int vs float differences between days are promoted.
+        """
+        schemas = [pq.read_schema(os.path.join(self._partition_dir(dataset, d), 'part-0.parquet'))
+                   for d in self.snapshots(dataset)]
+        schemas = [sc.remove_metadata() for sc in schemas] + [pa.schema([(PARTITION, pa.string())])]
+        return pa.unify_schemas(schemas, promote_options='permissive')
+
+    def query(self, dataset, start=None, end=None, columns=None, filter=None):
+        """
+        Rows from every snapshot between start and end (inclusive) with a snapshot_date column.
+        Partitions outside the range are never opened; filter is a pyarrow expression,
+        e.g. ds.field('complianceState') == 'noncompliant'.
+        """
+        dataset_ = ds.dataset(self._dataset_dir(dataset), format='parquet', schema=self._schema(dataset),
+                              partitioning=ds.partitioning(pa.schema([(PARTITION, pa.string())]), flavor='hive'))
+        expr = None
+        if start is not None:
+            expr = ds.field(PARTITION) >= _as_date(start).isoformat()
+        if end is not None:
+            upper = ds.field(PARTITION) <= _as_date(end).isoformat()
+            expr = upper if expr is None else expr & upper
+        if filter is not None:
+            expr = filter if expr is None else expr & filter
+        if columns is not None:
+            columns = list(dict.fromkeys(list(columns) + [PARTITION]))
+        if columns is None:
+            columns = [n for n in dataset_.schema.names if n != HASH_COL]
+        out = dataset_.to_table(columns=columns, filter=expr).to_pandas()
+        out[PARTITION] = pd.to_datetime(out[PARTITION]).dt.date
+        return out
+
+    def diff(self, dataset, old_date, new_date, key, details=True):
+        """
+        Compares two snapshots by key using the stored fingerprints.
+        Returns {'added', 'removed', 'changed'}: key frames, or full rows when details=True
+        (new rows for added/changed, old rows for removed).
+        """
+        keys = [key] if isinstance(key, str) else list(key)
+        old = self.read(dataset, old_date, columns=keys + [HASH_COL])
+        new = self.read(dataset, new_date, columns=keys + [HASH_COL])
+        both = old.merge(new, on=keys, how='outer', suffixes=('_old', '_new'), indicator=True)
+        added = both.loc[both['_merge'] == 'right_only', keys]
+        removed = both.loc[both['_merge'] == 'left_only', keys]
+        changed = both.loc[(both['_merge'] == 'both')
+                           & (both[f'{HASH_COL}_old'] != both[f'{HASH_COL}_new']), keys]
+        if not details:
+            return {'added': added.reset_index(drop=True), 'removed': removed.reset_index(drop=True),
+                    'changed': changed.reset_index(drop=True)}
+        return {
+            'added': self._rows(dataset, new_date, keys, added),
+            'removed': self._rows(dataset, old_date, keys, removed),
+            'changed': self._rows(dataset, new_date, keys, changed),
+        }
+
+    def _rows(self, dataset, date, keys, wanted):
+        if wanted.empty:
+            return self.read(dataset, date).iloc[0:0].drop(columns=[HASH_COL])
+        if len(keys) == 1:
+            # predicate pushdown, only row groups containing these keys are decoded
+            rows = self.read(dataset, date, filters=[(keys[0], 'in', wanted[keys[0]].tolist())])
+        else:
+            rows = self.read(dataset, date).merge(wanted, on=keys, how='inner')
+        return rows.drop(columns=[HASH_COL]).reset_index(drop=True)
@@ -0,0 +1,209 @@
+#Stale asset stage: Intune managed devices joined with user sign-in activity
+#Needs DeviceManagementManagedDevices.Read.All, User.Read.All and AuditLog.Read.All (for signInActivity)
+#Pages are reduced to the handful of fields used here as they arrive so 500k devices / 200k users
+#never exist as full json_normalize frames.  Only rows whose flag changed are written to SQL.
+#intune_device_rows() is the intune_devices table transform, shared by managed_devices.py and the
+#device change handler.
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text, bindparam
+
+from graph_models import User, ManagedDevice, iter_pages, to_frame
+
+USERS_URL = ("https://graph.microsoft.com/v1.0/users?$top=999"
+             "&$select=id,userPrincipalName,accountEnabled,signInActivity")
+DEVICES_URL = ("https://graph.microsoft.com/v1.0/deviceManagement/managedDevices?$top=1000"
+               "&$select=id,userId,deviceName,userPrincipalName,operatingSystem,complianceState,"
+               "lastSyncDateTime,enrolledDateTime,complianceGracePeriodExpirationDateTime,azureADDeviceId,serialNumber")
+
+DEVICE_FIELDS = ['id', 'userId', 'deviceName', 'userPrincipalName', 'operatingSystem', 'complianceState',
+                 'lastSyncDateTime', 'enrolledDateTime', 'complianceGracePeriodExpirationDateTime',
+                 'azureADDeviceId', 'serialNumber']
+CATEGORY_FIELDS = ['operatingSystem', 'complianceState']
+GUID_FIELDS = ['id', 'userId', 'azureADDeviceId']
+DATE_FIELDS = ['lastSyncDateTime', 'enrolledDateTime', 'complianceGracePeriodExpirationDateTime']
+
+
+def _dates(values):
+    #Graph uses 0001-01-01T00:00:00Z for "never"
+    s = pd.Series(values, dtype='string')
+    s = s.mask(s.str.startswith('0001-', na=False))
+    return pd.to_datetime(s, utc=True, errors='coerce')
+
+
+def fetch_sign_in_activity(headers, url=USERS_URL, registry=None):
+    """
+    One row per user indexed by id: upn, enabled, last interactive / non-interactive sign-in.
+    With a guid_keys.GuidRegistry the index is int32 codes instead of id strings.
+    """
+    ids, upns, enabled, interactive, non_interactive = [], [], [], [], []
+    pages = 0
+    for page in iter_pages(url, headers, User):
+        for u in page:
+            act = u.signInActivity
+            ids.append(u.id)
+            upns.append(u.userPrincipalName)
+            enabled.append(u.accountEnabled is not False)
+            interactive.append(act.lastSignInDateTime if act else None)
+            non_interactive.append(act.lastNonInteractiveSignInDateTime if act else None)
+        pages += 1
+        if pages % 50 == 0:
+            print(f"  {len(ids)} users")
+    users = pd.DataFrame({
+        'user_upn': pd.array(upns, dtype='string'),
+        'account_enabled': np.array(enabled, dtype=bool),
+        'last_sign_in': _dates(interactive).array,
+        'last_non_interactive_sign_in': _dates(non_interactive).array,
+    }, index=pd.Index(registry.encode(ids) if registry is not None else pd.array(ids, dtype='string'), name='userId'))
+    return users[~users.index.duplicated()]
+
+
+def fetch_devices(headers, url=DEVICES_URL, registry=None):
+    """Managed devices reduced to DEVICE_FIELDS, strings as categories where they repeat."""
+    frames = []
+    for page in iter_pages(url, headers, ManagedDevice):
+        if page:
+            frames.append(to_frame(page, ManagedDevice, columns=DEVICE_FIELDS))
+    devices = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=DEVICE_FIELDS)
+    return compact_devices(devices, registry)
+
+
+def compact_devices(devices, registry=None):
+    out = devices[[c for c in DEVICE_FIELDS if c in devices.columns]].copy()
+    for col in CATEGORY_FIELDS:
+        if col in out.columns:
+            out[col] = out[col].astype('category')
+    for col in DATE_FIELDS:
+        if col in out.columns:
+            out[col] = _dates(out[col])
+    for col in ['id', 'userId', 'deviceName', 'userPrincipalName', 'azureADDeviceId', 'serialNumber']:
+        if col in out.columns:
+            out[col] = out[col].astype('string')
+    # Intune leaves userId empty for shared / userless devices
+    out['userId'] = out['userId'].mask(out['userId'].str.len() == 0)
+    if registry is not None:
+        # int32 codes shared with the users frame, decoded again in write_flagged_delta
+        out = registry.encode_columns(out, GUID_FIELDS)
+    return out
+
+
+def classify_devices(devices, users, now=None, sync_days=30, sign_in_days=30, compliance_days=14):
+    """
+    Hash join devices -> users on userId, then flag each device:
+      orphaned       - user deleted or disabled
+      stale          - no sync and no interactive sign-in within the window
+      sync_stale     - device hasn't synced but the user is still signing in (reimage / replaced)
+      noncompliant   - noncompliant and past the grace period by more than compliance_days
+      user_inactive  - device syncs but the user hasn't signed in interactively
+      active         - everything else
+    """
+    now = pd.Timestamp.now(tz='UTC') if now is None else pd.Timestamp(now, tz='UTC')
+    joined = devices.join(users, on='userId', how='left')
+
+    user_id = joined['userId']
+    has_user = user_id >= 0 if pd.api.types.is_integer_dtype(user_id) else user_id.notna()
+    user_found = joined['account_enabled'].notna()
+    enabled = joined['account_enabled'].fillna(False).astype(bool)
+    sync_age = (now - joined['lastSyncDateTime']).dt.days
+    sign_in_age = (now - joined['last_sign_in']).dt.days
+    overdue = (now - joined['complianceGracePeriodExpirationDateTime']).dt.days
+
+    stale_sync = sync_age.isna() | (sync_age > sync_days)
+    inactive = sign_in_age.isna() | (sign_in_age > sign_in_days)
+    noncompliant = (joined['complianceState'].astype('string') == 'noncompliant') & (overdue > compliance_days)
+
+    conditions = [
+        has_user & (~user_found | ~enabled),
+        stale_sync & (inactive | ~has_user),
+        stale_sync,
+        noncompliant.fillna(False),
+        has_user & inactive,
+    ]
+    choices = ['orphaned', 'stale', 'sync_stale', 'noncompliant', 'user_inactive']
+    joined['stale_status'] = pd.Categorical(np.select(conditions, choices, default='active'),
+                                            categories=choices + ['active'])
+    joined['days_since_sync'] = sync_age.astype('Int32')
+    joined['days_since_sign_in'] = sign_in_age.astype('Int32')
+    joined['days_past_grace'] = overdue.where(overdue > 0).astype('Int32')
+    return joined
+
+
+def write_flagged_delta(classified, engine, table='intune_stale_devices', key='id', registry=None):
+    """
+    Keeps table in sync with the flagged (non-active) devices by writing only the difference:
+    new or re-classified devices are inserted, devices that recovered or changed status are removed.
+    Returns (inserted, removed).
+    """
+    flagged = classified[classified['stale_status'] != 'active'].copy()
+    if registry is not None:
+        flagged = registry.decode_columns(flagged, GUID_FIELDS)
+    flagged['stale_status'] = flagged['stale_status'].astype(str)
+    flagged['flagged_on'] = pd.Timestamp.now(tz='UTC').tz_localize(None)
+    for col in flagged.select_dtypes(include=['datetimetz']).columns:
+        flagged[col] = flagged[col].dt.tz_localize(None)
+    for col in flagged.select_dtypes(include=['category']).columns:
+        flagged[col] = flagged[col].astype(str)
+
+    if inspect(engine).has_table(table):
+        existing = pd.read_sql(f"SELECT {key}, stale_status FROM {table}", engine)
+    else:
+        existing = pd.DataFrame(columns=[key, 'stale_status'])
+
+    current = dict(zip(flagged[key], flagged['stale_status']))
+    previous = dict(zip(existing[key], existing['stale_status']))
+    to_remove = [k for k, status in previous.items() if current.get(k) != status]
+    to_insert = flagged[[previous.get(k) != status for k, status in zip(flagged[key], flagged['stale_status'])]]
+
+    #one transaction: a failed insert must not leave re-classified devices deleted
+    with engine.begin() as conn:
+        if to_remove:
+            stmt = text(f"DELETE FROM {table} WHERE {key} IN :ids").bindparams(bindparam('ids', expanding=True))
+            for start in range(0, len(to_remove), 1000):
+                conn.execute(stmt, {'ids': to_remove[start:start + 1000]})
+        if len(to_insert):
+            to_insert.to_sql(table, conn, if_exists='append', index=False, chunksize=1000)
+    print(f"{table}: {len(to_insert)} flagged devices written, {len(to_remove)} cleared")
+    return len(to_insert), len(to_remove)
+
+
+# ---- intune_devices table ----
+
+INTUNE_COLUMNS = ['id', 'userId', 'last_sync_date', 'deviceName', 'managedDeviceOwnerType',
+                  'complianceState', 'osVersionName', 'osVersion', 'operatingSystem',
+                  'azureADRegistered', 'deviceEnrollmentType', 'emailAddress', 'azureADDeviceId',
+                  'deviceCategoryDisplayName', 'isSupervised', 'isEncrypted', 'userPrincipalName', 'model', 'manufacturer',
+                  'serialNumber', 'userDisplayName', 'wiFiMacAddress']
+
+
+#translate os versions to build names
+#Windows 10.0.22 or higher is Windows 11, below 10.
+#Mac so many versions...
+def identify_os_version(os_version):
+    if os_version.startswith("10.0.22") or os_version.startswith("10.0.23") or os_version.startswith("10.0.24")or os_version.startswith("10.0.25")or os_version.startswith("10.0.26")or os_version.startswith("10.0.27"):
+        return "Windows 11"
+    elif os_version.startswith("10.0"):
+        return "Windows 10"
+    elif os_version.startswith("13"):
+        return f"macOS Ventura {os_version}"
+    elif os_version.startswith("14"):
+        return f"macOS Big Sur {os_version}"
+    elif os_version.startswith("15"):
+        return f"macOS Monterey {os_version}"
+    else:
+        return f"Unknown {os_version}"
+
+
+def intune_device_rows(devices, exclude_upns=None):
+    """
+    json_normalize of managedDevices -> intune_devices rows: devices without a user dropped,
+    last_sync_date and osVersionName derived.  exclude_upns removes e.g. test users.
+    """
+    filtered = devices.replace('', pd.NA).reindex(columns=list(dict.fromkeys(
+        [c for c in INTUNE_COLUMNS if c not in ('last_sync_date', 'osVersionName')] + ['lastSyncDateTime'])))
+    if exclude_upns:
+        filtered = filtered[~filtered['userPrincipalName'].isin(exclude_upns)]
+    filtered = filtered.dropna(subset=['userPrincipalName'])
+    filtered['last_sync_date'] = pd.to_datetime(filtered['lastSyncDateTime'], errors='coerce').dt.date
+    filtered['osVersionName'] = filtered['osVersion'].fillna('').astype(str).apply(identify_os_version)
+    return filtered[INTUNE_COLUMNS].reset_index(drop=True)